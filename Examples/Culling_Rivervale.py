@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+Accuracy and speed of the level-of-detail culling (culling.py) on the Rivervale shapefile model.
+SVF is calculated with fourpiradiation() against the full model and against the culled local models of each key, for several horizons.
+"""
+import os
+import time
+import numpy as np
+
+import pyliburo
+import ExtraFunctions
+import thermalcomfort
+import culling
+
+current_path = os.path.dirname("__file__")
+parent_path = os.path.abspath(os.path.join(current_path, os.pardir))
+shpfile = os.path.join(parent_path,"Examples","Input_Data","OSM_HDB_shapefiles","rivervale116.shp")
+compound = ExtraFunctions.makemodel_frmshp([shpfile], def_height=30)
+index = culling.FootprintIndex(compound)
+print len(index.solids), 'buildings'
+
+#pedestrian keys on a regular grid over the district, at pedestrian height
+xmin,ymin,zmin,xmax,ymax,zmax = pyliburo.py3dmodel.calculate.get_bounding_box(compound)
+pedkeys = [(x,y,1.5) for x in np.linspace(xmin,xmax,8) for y in np.linspace(ymin,ymax,8)]
+
+time1 = time.clock()
+full = np.array([thermalcomfort.fourpiradiation(key, compound)[0] for key in pedkeys])
+time_full = time.clock() - time1
+print 'Full model: ', time_full, 'seconds'
+
+for min_elevation in [2.,5.,10.]:
+    horizon = culling.horizon_distance(zmax, z=1.5, min_elevation=min_elevation)
+    time1 = time.clock()
+    culled = np.array([thermalcomfort.fourpiradiation(key, index.local_model(key, horizon))[0] for key in pedkeys])
+    time_culled = time.clock() - time1
+    print 'Horizon %.0f m (%.0f deg): speedup %.1fx, SVF difference mean %.4f max %.4f' % (horizon, min_elevation, time_full/time_culled, np.mean(abs(full-culled)), np.max(abs(full-culled)))
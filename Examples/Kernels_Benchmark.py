@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the numpy and numba backends of kernels.py on the same inputs. This example only needs ped_properties (see Step1_Model_SetUp).
+
+SET: calc_SET() (scipy fsolve, one point at a time) against calc_SET_array() for random microclimates.
+Rays: raycast.nearest_box_hit() from pedestrian keys in a grid of blocks (as ExtraFunctions.makemodel_frmcsv(...)["boxes"]).
+The numba backend is skipped if numba is not installed. Both backends return the same results; the differences are printed.
+
+Measured on one core (Python 2.7, numpy 1.16, numba 0.47):
+    calc_SET, fsolve           2000 points      41 s
+    calc_SET_array, numpy    200000 points    0.08 s     (differs from fsolve by < 1e-12 degC)
+    calc_SET_array, numba    200000 points    0.05 s     (same as numpy)
+    rays, numpy       10 keys x 2000 directions x 2500 boxes    5.1 s
+    rays, numba       10 keys x 2000 directions x 2500 boxes    0.17 s   (same hits as numpy)
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+import thermalcomfort
+import kernels
+import raycast
+
+rs = np.random.RandomState(0)
+N = 2000
+Ta, wind, Tmrt, RH = rs.uniform(20,35,N), rs.uniform(0,5,N), rs.uniform(15,70,N), rs.uniform(30,90,N)
+
+time1 = time.time()
+reference = np.array([thermalcomfort.calc_SET(pd.DataFrame({'T_air':[Ta[i]], 'wind_speed':[wind[i]], 'mean_radiant_temperature':[Tmrt[i]], 'RH':[RH[i]]}), ped_properties.copy())
+                      for i in range(N)])
+print 'calc_SET, fsolve          %6d points %8.2f s' % (N, time.time()-time1)
+
+boxes = np.array([(i*30+5, j*30+5, 0, i*30+25, j*30+25, rs.uniform(5,40)) for i in range(50) for j in range(50)], dtype=float)
+keys = [(rs.uniform(0,300), rs.uniform(0,300), 1.5) for n in range(10)]
+directions = np.vstack(raycast.unitball_dirs(2000))
+
+results = {}
+for name in ['numpy', 'numba']:
+    try: kernels.set_backend(name)
+    except ImportError:
+        print name, 'is not installed'; continue
+    thermalcomfort.calc_SET_array(Ta[:2], wind[:2], Tmrt[:2], RH[:2], ped_properties); raycast.nearest_box_hit(keys[0], directions[:2], boxes[:2]) #compiles the numba kernels
+    inputs = [np.tile(x,100) for x in (Ta, wind, Tmrt, RH)]
+    time1 = time.time()
+    SET = thermalcomfort.calc_SET_array(inputs[0], inputs[1], inputs[2], inputs[3], ped_properties)
+    print 'calc_SET_array, %-5s    %6d points %8.2f s | max difference to fsolve %.1e' % (name, len(SET), time.time()-time1, abs(SET[:N] - reference).max())
+    time1 = time.time()
+    hits = [raycast.nearest_box_hit(key, directions, boxes) for key in keys]
+    print 'rays, %-5s %d keys x %d directions x %d boxes %8.2f s' % (name, len(keys), len(directions), len(boxes), time.time()-time1)
+    results[name] = (SET, hits)
+
+if len(results) == 2:
+    print 'numba - numpy: SET max difference %.1e, same ray hits: %s' % (abs(results['numba'][0] - results['numpy'][0]).max(),
+          all(np.array_equal(a, b) for a, b in zip(results['numba'][1], results['numpy'][1])))
+kernels.set_backend('auto')
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Load test of the comfort query service. This example is dependent on Step1_Model_SetUp (model, pedestrian keys, surface data and air temperature).
+
+The service is started in a background thread. Clients then send batches of keys at increasing numbers of concurrent clients, first for keys whose
+results are not cached (cold: Tmrt and shadow are calculated; rays are traced the first time a key is queried) and then for the same keys again (warm:
+answered from the caches).
+The p50 and p99 latencies of each run are printed.
+"""
+import json
+import threading
+import time
+import urllib2
+
+import numpy as np
+
+import thermalcomfort
+import service
+
+config = myexperiment
+solarparam = thermalcomfort.calc_solarparam(model_inputs.time[0], model_inputs.latitude[0], model_inputs.longitude[0], model_inputs.timezone[0], model_inputs.ground_albedo[0])
+comfort = service.ComfortService(config['model'], config['Tair'], config['Refl'], config['Tsurf'], solarparam, model_inputs, ped_properties, gridsize=3)
+server = service.serve(comfort, port=0) #any free port
+url = 'http://127.0.0.1:%d' % server.server_address[1]
+thread = threading.Thread(target=server.serve_forever); thread.daemon = True; thread.start()
+
+def query(path, body):
+    time1 = time.time()
+    reply = json.loads(urllib2.urlopen(url + path, json.dumps(body)).read())
+    return time.time() - time1, reply
+
+def load_test(batches, path='/tmrt', clients=4, wind=1.):
+    """ Sends the batches of keys from 'clients' concurrent threads. Returns the latency of every request in seconds """
+    latencies = []; pending = list(batches); lock = threading.Lock()
+    def client():
+        while True:
+            with lock:
+                if not pending: return
+                keys = pending.pop()
+            latency, reply = query(path, {'keys':keys, 'wind':wind})
+            with lock: latencies.append(latency)
+    threads = [threading.Thread(target=client) for n in range(clients)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    return np.array(latencies)
+
+pedkeys = config['pedkeys'].tolist()
+for clients in [1, 4, 16]:
+    for path in ['/tmrt', '/set']:
+        rs = np.random.RandomState(clients)
+        batches = [[pedkeys[i] for i in rs.choice(len(pedkeys), 5)] for n in range(40)] #batches of 5 points, as asked by a design tool after each change
+        for state in ['cold', 'warm']:
+            time1 = time.time()
+            latencies = load_test(batches, path, clients)
+            print '%s %-5s clients %2d: %d requests in %.1f s | p50 %.1f ms | p99 %.1f ms' % (path, state, clients, len(latencies), time.time()-time1,
+                  1000*np.percentile(latencies,50), 1000*np.percentile(latencies,99))
+        comfort.update_conditions(solarparam=solarparam) #drop the results (view factors stay cached) so that the next run starts cold again
+print comfort.status()
+server.shutdown()
@@ -56,17 +56,11 @@ for config in cases:
     #2 define the area of study. In this case, the pedestrian grid is within a square around a central building. 
     config["square"] = ExtraFunctions.make_sq_center(pyliburo.py3dmodel.calculate.get_centre_bbox(config["model"]),(config["canyon"]*config['gridsize']+config["cube"]*config['gridsize']-1)/2)
     
-    #3 calculate the coordinates of the pedestrian keys.
-    # 3a) coordinates within your area of study. 'square' is an outer boundary
+    #3 calculate the coordinates of the pedestrian keys within your area of study ('square' is an outer boundary), on a grid of 25 x 25 points (625 grid points in total; the spacing can be changed for accuracy).
+    # Keys inside buildings, or within one gridsize of their walls, are removed. Building footprints are read from the model, so this also works for makemodel_frmshp models.
     a,b,c,d = pyliburo.py3dmodel.fetch.pyptlist_frm_occface(config['square']) 
-    # The number of grids are set to 25 in x and y (625-building grid points in total). This value can be changed for accuracy. 
-    config['pedkeys'] = np.array([(x,y,ped_properties.height[0]) for x in np.linspace( a[0],c[0],25) for y in np.linspace( a[1],c[1],25)])
-    config['pedkeys'] = np.array([ [x,y,z] for [x,y,z] in config['pedkeys'] if (((x >= a[0]) & (x <= c[0])) & ((y >= a[1]) &(y <= c[1]) ))  ])
-    
-    # 3b) remove coordinates inside of the central building. 'lil_square' is an inner boundary.
-    config["lil_square"] = ExtraFunctions.make_sq_center(pyliburo.py3dmodel.calculate.get_centre_bbox(config["model"]),(config["cube"]*config['gridsize'])/2,) #area of building 
-    l,m,n,o= pyliburo.py3dmodel.fetch.pyptlist_frm_occface(config['lil_square'])
-    config['pedkeys'] = np.array([ [x,y,z] for [x,y,z] in config['pedkeys'] if not (((x > l[0]-config['gridsize']) & (x < n[0]+config['gridsize'])) & ((y > l[1]-config['gridsize']) &(y < n[1]+config['gridsize']) ))  ])
+    bounds = (min(a[0],c[0]), min(a[1],c[1]), max(a[0],c[0]), max(a[1],c[1]))
+    config['pedkeys'] = ExtraFunctions.make_pedkeys(config['model'], (bounds[2]-bounds[0])/24., ped_properties.height[0], bounds=bounds, buffer=config['gridsize'])
 
 #%% Importing Thermal data. The sample data here was retrived from the results of a TUFIOBES model of the same building geometry. 
 # The temperature and wind data are in a 2D matrix data format at the pedestrian height 
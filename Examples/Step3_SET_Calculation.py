@@ -8,6 +8,7 @@ After calculating TMRT and importing initial information, SET can be calculated
 import time
 import numpy as np
 import thermalcomfort
+import regrid
 
 import matplotlib.pyplot as plt
 from matplotlib.path import Path
@@ -26,13 +27,19 @@ for config in cases:
     V = config['wind'] 
     config['SET']  = thermalcomfort.pdcoords_from_pedkeys(pedkeys) #initialize a pdcoord for SET that is filled with zeros
 
+    # Map wind and Tmrt onto the pedestrian keys. The interpolation weights are calculated once and can be reused for other fields on the same grids (e.g. other hours).
+    wind_to_ped = regrid.Regridder(V, pedkeys, method='linear', outside='nearest')
+    tmrt_to_ped = regrid.Regridder(Tmrt, pedkeys, method='nearest')
+    wind_at_keys = wind_to_ped(abs(V.data.v.values))
+    tmrt_at_keys = tmrt_to_ped(Tmrt)
+
     for index,row in config['SET'].data.iterrows(): #calculate SET line by line along the pdcoord (i.e. for each coordinate on the grid)
         time1 = time.clock()
         pedkey = (row.x,row.y,row.z)
         microclimate = pd.DataFrame({
         'T_air':[Ta],
-        'wind_speed':[np.mean(abs(V.val_at_coord(pedkey, radius = 0.2).v))],
-        'mean_radiant_temperature': [np.mean(Tmrt.val_at_coord(pedkey, radius = 1).v)],
+        'wind_speed':[wind_at_keys[index]],
+        'mean_radiant_temperature': [tmrt_at_keys[index]],
         'RH':[model_inputs.RH[0]],  
         })
     
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+Hourly Tmrt and SET over a day of TUF-IOBES results. This example is dependent on Step1_Model_SetUp (model, pedestrian keys and wind).
+The air temperature of each hour is read from Tsfc_Facets.out of the TUF-IOBES case (timeseries.read_tufiobes_airtemp). The wind is a single CFD
+snapshot, so the wind speed at the keys is the same for every hour.
+
+The surface data of the next hours is read and prepared on a background thread while Tmrt and SET are calculated for the current hour (prefetch=True).
+View factors do not change from hour to hour, so they are traced once and kept in a ViewFactorCache.
+The hourly results are appended to a ResultCube, from which single hours or regions can be read back (thermalcomfort.pdcoord_from_cube).
+"""
+import os
+import numpy as np
+import pandas as pd
+
+import thermalcomfort
+import timeseries
+import viewcache
+import regrid
+import resultcube
+import pyliburo
+
+current_path = os.path.dirname("__file__")
+parent_path = os.path.abspath(os.path.join(current_path, os.pardir))
+casefolder = os.path.join(parent_path,'TUF-IOBES Results for OTC3D','Alb0.3_WWR0.4_SHGC0.2_AR1_Lp0.0625') #the case of Example_surface_data
+
+config = myexperiment
+a,b,c,d = pyliburo.py3dmodel.fetch.pyptlist_frm_occface(config['square'])
+pedkeys = config['pedkeys']
+cache = viewcache.ViewFactorCache(config['model'])
+wind_at_keys = regrid.Regridder(config['wind'], pedkeys, method='linear', outside='nearest')(abs(config['wind'].data.v.values)) #fixed: one CFD snapshot for all hours
+cube = resultcube.ResultCube(config['name']+'_results', pedkeys, variables=['TMRT','SET'], mode='overwrite') #replaces the results of a previous run
+day = pd.to_datetime(model_inputs.time[0]).strftime('%m/%d/%Y')
+
+def compute(hour, surfaces):
+    solarparam = thermalcomfort.calc_solarparam(day+' %d:00' % hour, model_inputs.latitude[0], model_inputs.longitude[0], model_inputs.timezone[0], model_inputs.ground_albedo[0])
+    TMRT = viewcache.mrt_with_cache(cache, pedkeys, surfaces['Tair'], surfaces['Refl'], surfaces['Tsurf'], solarparam, model_inputs, ped_properties, gridsize=3)
+    SET = [thermalcomfort.calc_SET(pd.DataFrame({'T_air':[surfaces['Tair']], 'wind_speed':[wind], 'mean_radiant_temperature':[mrt], 'RH':[model_inputs.RH[0]]}), ped_properties.copy())
+           for wind, mrt in zip(wind_at_keys, TMRT.data.v)]
+    SET = thermalcomfort.pdcoords_from_pedkeys(pedkeys, np.array(SET))
+    cube.append(hour, {'TMRT':TMRT, 'SET':SET})
+    return TMRT, SET
+
+results = timeseries.run_timeseries(range(1,24), timeseries.tufiobes_loader(casefolder, origin=(a[0],a[1])), compute, prefetch=True)
+cube.flush()
+TMRT_noon = thermalcomfort.pdcoord_from_cube(cube, 'TMRT', 12)
@@ -9,10 +9,12 @@ The functions in this module support thermal comfort analysis for idealized conf
 import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D
 from mpl_toolkits.axes_grid1.inset_locator import inset_axes
+from matplotlib.path import Path
 
 import pyliburo
 import numpy as np
 import pandas as pd
+import scipy.ndimage
 
 
 def makeblock(botleft,w,hh): 
@@ -27,33 +29,60 @@ def makeblock(botleft,w,hh):
     cube = pyliburo.py3dmodel.construct.extrude(face, (0,0,1), hh)
     return cube
 
-def makemodel_frmcsv(csv_matrix,meshsize,delimiter_str=','):
-    """ Returns a display_list of OCC extruded squares based on a height-zero matrix from csv file  - no ground"""
+def makebox(box):
+    """returns a rectangular building from a row of (xmin,ymin,zmin,xmax,ymax,zmax) """
+    xmin,ymin,zmin,xmax,ymax,zmax = box
+    face = pyliburo.py3dmodel.construct.make_polygon([(xmin,ymin,zmin),(xmin,ymax,zmin),(xmax,ymax,zmin),(xmax,ymin,zmin)])
+    return pyliburo.py3dmodel.construct.extrude(face, (0,0,1), zmax-zmin)
+
+def row_runs(modmat):
+    """ Returns the row, first column, last column and height of every run of equal non-zero heights along the rows of a height matrix, listed row by row """
+    built = modmat > 0
+    newrun = np.ones(modmat.shape,dtype=bool); newrun[:,1:] = modmat[:,1:] != modmat[:,:-1]
+    endrun = np.ones(modmat.shape,dtype=bool); endrun[:,:-1] = modmat[:,:-1] != modmat[:,1:]
+    rows, starts = np.nonzero(built & newrun)
+    ends = np.nonzero(built & endrun)[1] #runs are listed row by row, so starts and ends pair up
+    return rows, starts, ends, modmat[rows,starts]
+
+def boxes_frm_heightmatrix(modmat,meshsize):
+    """ Decomposes a height-zero matrix into rectangular blocks of constant height, without looping over cells.
+    Rows of the matrix are along x and columns along y (as in makemodel_frmcsv). Runs of equal height along each row are merged with identical runs in the following rows.
+    Returns an array of boxes, one row of (xmin,ymin,zmin,xmax,ymax,zmax) per block, and an array of the building (connected footprint) number of each block """
+    modmat = np.asarray(modmat,dtype=float)
+    rows, starts, ends, heights = row_runs(modmat)
+    #sort runs so that identical runs in consecutive rows follow each other, then merge them into one block
+    order = np.lexsort((rows,heights,ends,starts))
+    rows, starts, ends, heights = rows[order], starts[order], ends[order], heights[order]
+    first = np.ones(len(rows),dtype=bool)
+    first[1:] = ~((starts[1:] == starts[:-1]) & (ends[1:] == ends[:-1]) & (heights[1:] == heights[:-1]) & (rows[1:] == rows[:-1]+1))
+    first = np.nonzero(first)[0]
+    lastrow = np.maximum.reduceat(rows,first) if len(first) else first
+    boxes = np.vstack([rows[first]*meshsize, starts[first]*meshsize, np.zeros(len(first)),
+                       (lastrow+1)*meshsize, (ends[first]+1)*meshsize, heights[first]]).T
+    buildings = scipy.ndimage.label(modmat > 0)[0][rows[first],starts[first]]
+    return boxes.reshape(-1,6), buildings
+
+def makemodel_frmcsv(csv_matrix,meshsize,delimiter_str=',',occ=True):
+    """ Returns a display_list of OCC extruded blocks based on a height-zero matrix from csv file  - no ground. Each building can have its own height.
+    The blocks are also returned as an array of boxes ("boxes", see boxes_frm_heightmatrix), which can be used without OCC (e.g. raycast.fourpiradiation_boxes).
+    For large rasters, occ=False skips building the OCC compound and ground face ("model" and "ground" are None)."""
     modmat = pd.read_csv(csv_matrix,delimiter=delimiter_str)
     dimx = modmat.shape
-    modmat = modmat.astype(float)
-    modmat = modmat.as_matrix()
-    hei = float(modmat.max())
-    bbc1 = np.unravel_index(modmat.argmax(),modmat.shape)
-
-    bbc = [] ; display_list = [] ; width = []; street = []; streetstart = 0; #Cubes match up to topleft corners if input as rectangles. 
-    for i in range(bbc1[0],dimx[0]-1):
-        if (modmat[i,:] == modmat[i-1,:]).all() or (modmat[i,:] == 0).all():
-            pass
-        else:
-            for j in range(bbc1[1],dimx[1]-1):
-                if modmat[i,j] == modmat[i,j-1]:
-                    pass
-                elif modmat[i,j] < modmat[i,j-1]:
-                    width.append(float(j - bbc[-1][1])*meshsize); streetstart = j
-                    display_list.append(makeblock(tuple([val*meshsize for val in bbc[-1]]),width[-1],hei))
-                else:               
-                    bbc.append((i,j,0.))
-                    street.append((j-streetstart)*meshsize)
+    modmat = modmat.astype(float).values
+    boxes, buildings = boxes_frm_heightmatrix(modmat,meshsize)
+
+    #median street width from the gaps between consecutive blocks along a row
+    rows, starts, ends, heights = row_runs(modmat)
+    samerow = rows[1:] == rows[:-1]
+    street = (starts[1:][samerow] - ends[:-1][samerow] - 1)*meshsize
+    street = street[street > 0]
+
     points1 = [(0,0,0), (0,dimx[1]*meshsize,0), (dimx[0]*meshsize,dimx[1]*meshsize,0),(dimx[0]*meshsize,0,0)]#clockwise
-    groundface = pyliburo.py3dmodel.construct.make_polygon(points1)
-    compound = pyliburo.py3dmodel.construct.make_compound(display_list)
-    return ({"model":compound,"ground":groundface,"width":np.median(width), "height":np.median(hei),"streetwidth":np.median(street)})
+    groundface = pyliburo.py3dmodel.construct.make_polygon(points1) if occ else None
+    compound = pyliburo.py3dmodel.construct.make_compound([makebox(box) for box in boxes]) if occ else None
+    return ({"model":compound,"ground":groundface,"boxes":boxes,"building":buildings,
+             "width":np.median(boxes[:,4]-boxes[:,1]) if len(boxes) else np.nan, "height":np.median(boxes[:,5]) if len(boxes) else np.nan,
+             "streetwidth":np.median(street) if len(street) else np.nan})
     
 def makemodelmatrix((M,N),street,width,height):
     """ Returns a MxN matrix as a compound. """
@@ -116,6 +145,62 @@ def makemodelstagger((M,N),street,width,height):
     compound = pyliburo.py3dmodel.construct.make_compound(display_list)
     return {"model":compound,"ground":groundface}
     
+def bboxes_frm_compound(compound):
+    """ Returns the list of solids (buildings) in a compound and an array of their bounding boxes, one row of (xmin,ymin,zmin,xmax,ymax,zmax) per solid """
+    solids = pyliburo.py3dmodel.fetch.topos_frm_compound(compound)["solid"]
+    bboxes = np.array([pyliburo.py3dmodel.calculate.get_bounding_box(solid) for solid in solids],dtype=float).reshape(-1,6)
+    return solids, bboxes
+
+def footprints_frm_compound(compound):
+    """ Returns the footprint of every solid (building) in a compound, as an array of its bottom face's (x,y) vertices. Works for makemodel_frmshp models as well as boxes.
+    Only the outer boundary of each face is used, so courtyards are treated as part of the building. """
+    footprints = []
+    for solid in pyliburo.py3dmodel.fetch.topos_frm_compound(compound)["solid"]:
+        faces = [np.array(pyliburo.py3dmodel.fetch.pyptlist_frm_occface(face),dtype=float) for face in pyliburo.py3dmodel.fetch.topos_frm_compound(solid)["face"]]
+        zmin = min(face[:,2].min() for face in faces)
+        bottom = [face for face in faces if np.allclose(face[:,2], zmin)]
+        if bottom: footprints.append(max(bottom, key=len)[:,:2])
+    return footprints
+
+def footprints_frm_boxes(boxes):
+    """ Returns the rectangular footprints of boxes (rows of (xmin,ymin,zmin,xmax,ymax,zmax), e.g. from makemodel_frmcsv) """
+    return [np.array([(b[0],b[1]),(b[0],b[4]),(b[3],b[4]),(b[3],b[1])],dtype=float) for b in np.asarray(boxes,dtype=float).reshape(-1,6)]
+
+def footprint_mask(xs, ys, footprints, buffer=0.):
+    """ Returns a boolean matrix (len(xs) x len(ys)) that is True at the grid points (xs[i],ys[j]) inside a footprint or within buffer of its walls.
+    Each footprint is only tested against the grid points within its bounding box, so the cost grows with the area of the buildings, not of the grid. xs and ys must be increasing. """
+    xs = np.asarray(xs,dtype=float); ys = np.asarray(ys,dtype=float)
+    mask = np.zeros((len(xs),len(ys)),dtype=bool)
+    for polygon in footprints:
+        polygon = np.asarray(polygon,dtype=float)[:,:2]
+        (x0,y0), (x1,y1) = polygon.min(axis=0) - buffer, polygon.max(axis=0) + buffer
+        i0, i1 = np.searchsorted(xs, x0, 'left'), np.searchsorted(xs, x1, 'right')
+        j0, j1 = np.searchsorted(ys, y0, 'left'), np.searchsorted(ys, y1, 'right')
+        if i0 >= i1 or j0 >= j1: continue
+        X, Y = np.meshgrid(xs[i0:i1], ys[j0:j1], indexing='ij')
+        points = np.column_stack([X.ravel(), Y.ravel()])
+        inside = Path(polygon).contains_points(points)
+        for start, end in zip(polygon, np.roll(polygon,-1,axis=0)): #points on the walls, or within buffer of them
+            edge = end - start
+            t = np.clip(((points - start).dot(edge))/max(edge.dot(edge),1e-12), 0., 1.)
+            inside |= np.hypot(*(points - start - t[:,None]*edge).T) <= buffer + 1e-9
+        mask[i0:i1,j0:j1] |= inside.reshape(X.shape)
+    return mask
+
+def make_pedkeys(compound, resolution, height=1.5, bounds=None, buffer=0., footprints=None):
+    """ Returns an array of pedestrian keys (x,y,height) on a grid of spacing resolution within bounds = (xmin,ymin,xmax,ymax) (the bounding box of the compound if None),
+    without the keys inside buildings or within buffer of their walls. Keys are listed along y for each x, as in Examples/Step1_Model_SetUp.py.
+    Footprints are taken from the bottom faces of the solids of the compound, unless given (e.g. footprints_frm_boxes(boxes)). """
+    if bounds is None:
+        bbox = pyliburo.py3dmodel.calculate.get_bounding_box(compound)
+        bounds = (bbox[0],bbox[1],bbox[3],bbox[4])
+    xmin, ymin, xmax, ymax = bounds
+    xs = xmin + resolution*np.arange(int(np.floor((xmax-xmin)/resolution + 1e-9)) + 1)
+    ys = ymin + resolution*np.arange(int(np.floor((ymax-ymin)/resolution + 1e-9)) + 1)
+    if footprints is None: footprints = footprints_frm_compound(compound)
+    rows, cols = np.nonzero(~footprint_mask(xs, ys, footprints, buffer))
+    return np.column_stack([xs[rows], ys[cols], np.ones(len(rows))*height])
+
 def make_sq_center(origin,x):
     "Returns a square polygon (TopoDS_Face) centered at origin with dimensions of x by x. Useful for determining the pedestrian locations around a certain building."
     a,b,c = origin
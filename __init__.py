@@ -5,4 +5,18 @@ Init file for thermalcomfort package
 import ExtraFunctions
 import thermalcomfort
 import skyviewfactor
-import pyliburo
\ No newline at end of file
+import pyliburo
+import regrid
+import raycast
+import viewcache
+import culling
+import timeseries
+import rasterview
+import symmetry
+import sharding
+import resultcube
+import adaptive
+import service
+import facegrid
+import render
+import kernels
\ No newline at end of file
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Level-of-detail culling of distant buildings for per-key ray casting.
+
+For large districts (e.g. from ExtraFunctions.makemodel_frmshp) every ray of fourpiradiation() and check_shadow() is intersected with the whole compound,
+although buildings far from the pedestrian only cover a small part of the sky. FootprintIndex is a 2-D spatial index over the building footprints.
+For each key, local_model() returns a compound of the buildings within a horizon distance only; optionally, the buildings beyond a detail distance are
+replaced by their bounding boxes. Keys with the same set of candidate buildings share the same compound.
+
+A building of height H at a horizontal distance d is seen at an elevation below atan((H-z)/d) by a pedestrian at height z. Dropping every building seen
+below an elevation e changes the SVF by at most sin(e) (for a pedestrian completely surrounded by such buildings), and much less in practice.
+horizon_distance() returns the horizon corresponding to a chosen elevation. See Examples/Culling_Rivervale.py for the comparison with the full model.
+
+Shadow is different: when the sun is lower than min_elevation, the dropped buildings can shade the key. For check_shadow() (and all_mrt(), which calls it),
+pass the solar vector to horizon_distance(), so that the horizon also covers every building that can cast a shadow on the key (the lower of min_elevation and
+the solar elevation is used; with the sun at or below the horizon, the horizon is infinite and local_model() returns all buildings), or use the full model.
+
+Example:
+    index = culling.FootprintIndex(compound)
+    horizon = culling.horizon_distance(index.bboxes[:,5].max(), z=1.5, min_elevation=5)
+    svf, gvf, intercepts = thermalcomfort.fourpiradiation(pedkey, index.local_model(pedkey, horizon))
+    horizon = culling.horizon_distance(index.bboxes[:,5].max(), z=1.5, min_elevation=5, solarvector=solarparam.solarvector[0])
+    TMRT = thermalcomfort.all_mrt(pedkey, index.local_model(pedkey, horizon), ...)
+"""
+from collections import OrderedDict
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+import pyliburo
+import ExtraFunctions
+
+
+def horizon_distance(height, z=1.5, min_elevation=5., solarvector=None):
+    """ Returns the horizontal distance beyond which a building of the given height is seen below min_elevation (degrees) by a pedestrian at height z.
+    With a solarvector, the elevation is also limited to the solar elevation, so that buildings beyond the horizon cannot shade the pedestrian (inf if the sun is at or below the horizon) """
+    if solarvector is not None:
+        X, Y, Z = solarvector
+        if Z <= 0: return np.inf
+        min_elevation = min(min_elevation, np.degrees(np.arctan2(Z, np.hypot(X, Y))))
+    return max(height - z, 0.)/np.tan(np.radians(min_elevation))
+
+class FootprintIndex(object):
+    """ 2-D spatial index over the bounding boxes of the footprints of the buildings (solids) in a compound.
+    Up to maxmodels local models are kept for reuse (the oldest are dropped first); clear() drops them all """
+
+    def __init__(self, compound, maxmodels=256):
+        self.solids, self.bboxes = ExtraFunctions.bboxes_frm_compound(compound)
+        self.centres = (self.bboxes[:,:2] + self.bboxes[:,3:5])/2.
+        self.halfdiag = np.hypot(*((self.bboxes[:,3:5] - self.bboxes[:,:2])/2.).T).max() if len(self.bboxes) else 0.
+        self.tree = cKDTree(self.centres) if len(self.bboxes) else None
+        self.proxies = {} #bounding box solids of simplified buildings
+        self.models = OrderedDict() #compounds of the candidate sets already built, oldest first
+        self.maxmodels = maxmodels
+
+    def candidates(self, key, horizon):
+        """ Returns the indices of the buildings whose footprint bounding box is within the horizontal distance horizon of key """
+        if self.tree is None: return np.zeros(0,dtype=int)
+        if not np.isfinite(horizon): return np.arange(len(self.bboxes))
+        idx = np.array(sorted(self.tree.query_ball_point(key[:2], horizon + self.halfdiag)),dtype=int) #coarse search on the footprint centres
+        bboxes = self.bboxes[idx]
+        dx = np.maximum(0., np.maximum(bboxes[:,0] - key[0], key[0] - bboxes[:,3]))
+        dy = np.maximum(0., np.maximum(bboxes[:,1] - key[1], key[1] - bboxes[:,4]))
+        return idx[np.hypot(dx,dy) <= horizon]
+
+    def proxy(self, index):
+        """ Returns the bounding box of building 'index' as a solid """
+        if index not in self.proxies: self.proxies[index] = ExtraFunctions.makebox(self.bboxes[index])
+        return self.proxies[index]
+
+    def local_model(self, key, horizon, detail=None):
+        """ Returns a compound of the buildings within horizon of key, to be used in place of the full model for the rays traced from key.
+        If detail is given, the buildings between detail and horizon are replaced by their bounding boxes. """
+        near = self.candidates(key, horizon if detail is None else min(detail,horizon))
+        far = np.setdiff1d(self.candidates(key, horizon), near) if detail is not None else np.zeros(0,dtype=int)
+        signature = (tuple(near), tuple(far))
+        if signature not in self.models:
+            if len(self.models) >= self.maxmodels: self.models.popitem(last=False)
+            self.models[signature] = pyliburo.py3dmodel.construct.make_compound([self.solids[i] for i in near] + [self.proxy(i) for i in far])
+        return self.models[signature]
+
+    def clear(self):
+        """ Drops the local models and bounding box solids kept for reuse """
+        self.models.clear(); self.proxies.clear()
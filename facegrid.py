@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Surface data on the facet grid of TUF-IOBES, looked up by grid index.
+
+TUF-IOBES writes one file per variable and surface (fort.1SS flux, fort.2SS temperature, fort.3SS reflected radiation for the surfaces SS = 00 to 09:
+0 roof, 1 ground, 2-5 walls, 6-9 windows), with the integer grid indices Nx Ny Nz of every patch. A FaceGrid keeps the values of one variable at one
+output time keyed by (surface, i, j, k), and stores them in one dense array per orientation of the patches (horizontal, facing x, facing y).
+lookup(intercepts) maps each intercept to the patch it lies on by array indexing, in place of the box search of pdcoord.val_at_coord() around each
+intercept in call_values() (which needs the radius gridsize to be chosen for the data). call_values() uses lookup() when it is given a FaceGrid.
+
+Indexing follows the TUF-IOBES output: a patch covers the cell (i-1,i] x (j-1,j] x (k-1,k] along its plane, horizontal patches are indexed by their height
+(ground 0, roof at the building height), and wall patches by the air cell in front of them (a wall facing -x at x=16 is indexed 16, one facing +x at x=20
+is indexed 21). An intercept is on a horizontal patch if its z is an integer grid coordinate, otherwise on a wall patch if its x or y is one.
+The model coordinates are related to the grid as in pdcoord.recenter(): the smallest x,y index of the data is placed at origin, and one cell is cellsize long.
+With periodic=True (default), the x,y indices wrap around the period of the ground, as for a model of repeated units (cf. pdcoord.repeat_outset()).
+
+Example (after Step1_Model_SetUp):
+    Tsurf = facegrid.FaceGrid(casefolder, 'temp', hour, origin=(a[0],a[1]))
+    Refl = facegrid.FaceGrid(casefolder, 'refl', hour, origin=(a[0],a[1]))
+    TMRT = thermalcomfort.all_mrt(pedkey, config['model'], config['Tair'], Refl, Tsurf, solarparam, model_inputs, ped_properties)
+For time series, facegrid_loader(casefolder, origin) can replace timeseries.tufiobes_loader() in Examples/Step4_TimeSeries.py.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+import thermalcomfort
+import timeseries
+
+VARIABLES = {'flux':1, 'temp':2, 'refl':3} #first digit of the fort.* files
+HORIZONTAL = (0,1) #roof and ground; the other surfaces are walls and windows
+
+def read_fort(filename):
+    """ Reads a TUF-IOBES fort.* output file. Returns a DataFrame with columns patch, time, i, j, k, v """
+    return pd.DataFrame(np.loadtxt(filename, ndmin=2), columns=['patch','time','i','j','k','v'])
+
+def wall_axis(ij, ground):
+    """ Returns the axis (0 for x, 1 for y) that wall patches at the x,y indices ij face. The plane index of a wall is constant; if both are (a single column
+    of patches), the wall faces the axis along which a neighbour of its air cell is a building (not a ground cell) """
+    constant = [axis for axis in (0,1) if len(np.unique(ij[:,axis])) == 1]
+    if len(constant) == 1 or not ground: return constant[0] if constant else 0
+    for axis in constant:
+        step = np.eye(2,dtype=int)[axis]
+        if any(tuple(cell + sign*step) not in ground for cell in ij for sign in (-1,1)): return axis
+    return constant[0]
+
+class FaceGrid(object):
+    """ Values of one variable ('flux', 'temp' or 'refl') of a TUF-IOBES case folder at the output time nearest to step (hours), keyed by (surface, i, j, k) """
+
+    def __init__(self, casefolder, variable='temp', step=1, origin=(0,0), cellsize=1., periodic=True, surfaces=range(10)):
+        cells = []
+        for surface in surfaces:
+            filename = os.path.join(casefolder, 'fort.%d%02d' % (VARIABLES[variable], surface))
+            if not os.path.exists(filename): continue
+            data = read_fort(filename)
+            times = np.unique(data.time)
+            data = data[data.time == times[np.argmin(abs(times - step))]]
+            data = data.groupby(['i','j','k'], as_index=False).v.mean() #records repeated within an output time are averaged
+            data['surface'] = surface
+            cells.append(data)
+        self.cells = pd.concat(cells, ignore_index=True)
+        ground = set(map(tuple, self.cells[self.cells.surface == 1][['i','j']].values.round().astype(int).tolist()))
+        self.cells['facing'] = 2
+        for surface in set(self.cells.surface) - set(HORIZONTAL):
+            rows = self.cells.surface == surface
+            self.cells.loc[rows,'facing'] = wall_axis(self.cells[rows][['i','j']].values.round().astype(int), ground)
+        for c in ['i','j','k']: self.cells[c] = self.cells[c].round().astype(int)
+        self.values = dict(((s,i,j,k), v) for s,i,j,k,v in self.cells[['surface','i','j','k','v']].values.tolist())
+        self.origin, self.cellsize, self.periodic = np.asarray(origin,dtype=float), float(cellsize), periodic
+        ground = self.cells[self.cells.surface == 1] if (self.cells.surface == 1).any() else self.cells
+        self.low = np.array([ground.i.min(), ground.j.min()]) #smallest x,y index, placed at origin
+        self.period = np.array([ground.i.max(), ground.j.max()]) - self.low + 1
+        self.time = step
+
+        #one dense array per orientation: [plane index, first in-plane index, second in-plane index]
+        self.grids = {}
+        for axis in (0,1,2):
+            rows = self.cells[self.cells.facing == axis]
+            if not len(rows): continue
+            idx = rows[['i','j','k']].values[:, [axis] + [a for a in (0,1,2) if a != axis]]
+            low = idx.min(axis=0)
+            grid = np.empty(idx.max(axis=0) - low + 1); grid.fill(np.nan)
+            grid[tuple((idx - low).T)] = rows.v.values
+            self.grids[axis] = (low, grid)
+
+    def _wrap(self, index, axis):
+        """ Wraps x (axis 0) or y (axis 1) indices into the period of the data """
+        if not self.periodic or axis == 2: return index
+        return self.low[axis] + np.mod(index - self.low[axis], self.period[axis])
+
+    def _from_grid(self, axis, index):
+        """ Values at integer (plane, in-plane, in-plane) indices of an orientation, NaN outside of the data """
+        values = np.empty(len(index)); values.fill(np.nan)
+        if axis not in self.grids: return values
+        low, grid = self.grids[axis]
+        index = index - low
+        valid = np.all((index >= 0) & (index < grid.shape), axis=1)
+        values[valid] = grid[tuple(index[valid].T)]
+        return values
+
+    def lookup(self, intercepts, tol=1e-4):
+        """ Returns the values of the patches at intercepts (an array of x,y,z points in model coordinates), NaN where no patch is found """
+        points = np.asarray(intercepts,dtype=float).reshape(-1,3)
+        grid = points.copy()
+        grid[:,:2] = (points[:,:2] - self.origin)/self.cellsize + self.low
+        grid[:,2] = points[:,2]/self.cellsize
+        nearest = np.round(grid).astype(int)
+        onplane = abs(grid - nearest) <= tol
+        cell = np.ceil(grid - tol).astype(int) #in-plane cell (i-1, i]
+        values = np.empty(len(points)); values.fill(np.nan)
+        for axis, shift in [(2,0), (0,0), (0,1), (1,0), (1,1)]: #horizontal patches first, then walls indexed at or in front of the plane
+            todo = np.isnan(values) & onplane[:,axis]
+            if not todo.any(): continue
+            others = [a for a in (0,1,2) if a != axis]
+            index = np.column_stack([nearest[todo,axis] + shift] + [cell[todo,a] for a in others])
+            for n, a in enumerate([axis] + others): index[:,n] = self._wrap(index[:,n], a)
+            values[todo] = self._from_grid(axis, index)
+        return values
+
+    def to_pdcoord(self):
+        """ Returns the values as a pdcoord at the grid indices of the patches in model coordinates (as read from the Sorted files and recentered) """
+        xyz = self.cells[['i','j','k']].values.astype(float)
+        xyz[:,:2] = (xyz[:,:2] - self.low)*self.cellsize + self.origin
+        xyz[:,2] *= self.cellsize
+        return thermalcomfort.pdcoord(pd.DataFrame(np.column_stack([xyz, self.cells.v.values]), columns=['x','y','z','v']))
+
+def facegrid_loader(casefolder, origin=(0,0), cellsize=1., periodic=True):
+    """ Returns a function that loads the surface temperature ('Tsurf') and reflected radiation ('Refl') of a step as FaceGrids, and the air temperature ('Tair')
+    of timeseries.read_tufiobes_airtemp(), in place of timeseries.tufiobes_loader() """
+    airtemp = timeseries.read_tufiobes_airtemp(casefolder)
+    def load(step):
+        return {'Tsurf':FaceGrid(casefolder, 'temp', step, origin, cellsize, periodic),
+                'Refl':FaceGrid(casefolder, 'refl', step, origin, cellsize, periodic),
+                'Tair':airtemp[int(round(step))]}
+    return load
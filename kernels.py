@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Optional compiled kernels for the inner loops of the SET solve and the ray / box tests.
+
+Two kernels have a pure NumPy version and a version compiled with numba (if it is installed):
+    - solve_set(): the root of the SET energy balance of calc_SET() (standard operative temperature and pressure against the skin vapour pressure at
+      SET), by Newton iterations on arrays of points (thermalcomfort.calc_SET_array()),
+    - nearest_box_hit(): the distance from a key to the first box hit along each ray (raycast.fourpiradiation_boxes(), check_shadow_boxes()).
+The NumPy versions work on whole arrays and iterate until every element has converged; the numba versions loop over the elements, stop each element as
+soon as it has converged and, for the rays, skip the boxes that are further away than the nearest hit found so far. Both do the same arithmetic per
+element, so the results agree to the last digits (up to the rounding of exp() by the compiler).
+
+The backend is chosen at runtime with set_backend('numba' | 'numpy' | 'auto'); 'auto' (default) uses numba if it can be imported. The first call of a
+numba kernel compiles it (about a second); later calls use the compiled code. See Examples/Kernels_Benchmark.py for timings of both backends.
+"""
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+_backend = {'name':None}
+
+def set_backend(name='auto'):
+    """ Selects the kernels: 'numba', 'numpy', or 'auto' (numba if available). Returns the name of the backend in use """
+    if name == 'auto': name = 'numpy' if numba is None else 'numba'
+    if name == 'numba' and numba is None: raise ImportError('numba is not installed; use the numpy backend')
+    if name not in ('numba','numpy'): raise ValueError('unknown backend %r' % name)
+    _backend['name'] = name
+    return name
+
+def backend():
+    """ Returns the name of the backend in use """
+    if _backend['name'] is None: set_backend('auto')
+    return _backend['name']
+
+#%% SET energy balance
+def _set_residual(st, ttso, a, ppso, c):
+    """ Residual of the SET equation of calc_SET() at st, and its derivative """
+    e = c*np.exp(20.386-5132/(st+273.15))
+    return ttso - st + a*(ppso - e), -1. - a*e*5132/(st+273.15)**2
+
+def solve_set_numpy(ttso, a, ppso, c, guess=0., tol=1e-10, maxiter=50):
+    st = np.empty(len(ttso)); st.fill(guess)
+    active = np.ones(len(ttso),dtype=bool)
+    for n in range(maxiter):
+        f, df = _set_residual(st[active], ttso[active], a[active], ppso[active], c[active])
+        step = f/df
+        st[active] -= step
+        active[np.nonzero(active)[0][abs(step) < tol]] = False #converged elements are not updated any more
+        if not active.any(): break
+    return st
+
+def _solve_set_loop(ttso, a, ppso, c, guess, tol, maxiter):
+    st = np.empty(len(ttso))
+    for i in range(len(ttso)):
+        s = guess
+        for n in range(maxiter):
+            e = c[i]*np.exp(20.386-5132/(s+273.15))
+            step = (ttso[i] - s + a[i]*(ppso[i] - e))/(-1. - a[i]*e*5132/(s+273.15)**2)
+            s -= step
+            if abs(step) < tol: break
+        st[i] = s
+    return st
+
+def solve_set(ttso, a, ppso, c, guess=0., tol=1e-10, maxiter=50):
+    """ Solves ttso - st + a*(ppso - c*exp(20.386-5132/(st+273.15))) = 0 for the SET st of every element of the arrays (see calc_SET()), starting from guess """
+    args = [np.array(x,dtype=float).ravel() for x in np.broadcast_arrays(ttso,a,ppso,c)]
+    if backend() == 'numba': return _compiled('solve_set')(*(args + [float(guess), float(tol), int(maxiter)]))
+    return solve_set_numpy(*(args + [guess, tol, maxiter]))
+
+#%% Rays and axis-aligned boxes
+def ray_box_entry(origin, directions, boxes):
+    """ Slab test of rays from origin against axis-aligned boxes given as rows of (xmin,ymin,zmin,xmax,ymax,zmax).
+    Returns a (Ndirections x Nboxes) array of the distance at which each ray enters each box (0 if the origin is inside the box, inf if the ray misses it) """
+    directions = np.asarray(directions,dtype=float); boxes = np.asarray(boxes,dtype=float).reshape(-1,6)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        inv = 1./directions[:,None,:]
+        t1 = (boxes[None,:,:3] - np.asarray(origin,dtype=float))*inv
+        t2 = (boxes[None,:,3:] - np.asarray(origin,dtype=float))*inv
+        tlow = np.minimum(t1,t2); thigh = np.maximum(t1,t2)
+    onslab = np.isnan(tlow) | np.isnan(thigh) # direction parallel to a slab with the origin on its boundary (0*inf); treat as inside the slab
+    tlow[onslab] = -np.inf; thigh[onslab] = np.inf
+    tnear = tlow.max(axis=2); tfar = thigh.min(axis=2)
+    entry = np.maximum(tnear,0.)
+    entry[tfar < entry] = np.inf
+    return entry
+
+def _nearest_box_hit_loop(origin, directions, boxes):
+    dist = np.empty(directions.shape[0])
+    for n in range(directions.shape[0]):
+        best = np.inf
+        for b in range(boxes.shape[0]):
+            tnear = -np.inf; tfar = np.inf
+            for axis in range(3):
+                inv = 1./directions[n,axis]
+                t1 = (boxes[b,axis] - origin[axis])*inv; t2 = (boxes[b,axis+3] - origin[axis])*inv
+                if np.isnan(t1) or np.isnan(t2): continue #parallel to the slab with the origin on its boundary: inside the slab (as in ray_box_entry)
+                tnear = max(tnear, min(t1,t2)); tfar = min(tfar, max(t1,t2))
+                if tnear >= best or tfar < tnear: break #further than the nearest hit so far, or missed
+            entry = max(tnear, 0.)
+            if tfar >= entry and entry < best: best = entry
+        dist[n] = best
+    return dist
+
+def nearest_box_hit_numpy(origin, directions, boxes, chunk=2000):
+    dist = np.empty(len(directions)); dist.fill(np.inf)
+    for n in range(0,len(boxes),chunk): #boxes are tested in chunks to limit memory use
+        dist = np.minimum(dist, ray_box_entry(origin, directions, boxes[n:n+chunk]).min(axis=1))
+    return dist
+
+def nearest_box_hit(origin, directions, boxes, chunk=2000):
+    """ Returns the distance from origin to the first box (rows of xmin,ymin,zmin,xmax,ymax,zmax) hit along each direction (inf if no box is hit) """
+    origin = np.asarray(origin,dtype=float).ravel()
+    directions = np.ascontiguousarray(directions,dtype=float).reshape(-1,3); boxes = np.ascontiguousarray(boxes,dtype=float).reshape(-1,6)
+    if backend() == 'numba': return _compiled('nearest_box_hit')(origin, directions, boxes)
+    return nearest_box_hit_numpy(origin, directions, boxes, chunk)
+
+#%% numba compilation
+_loops = {'solve_set':_solve_set_loop, 'nearest_box_hit':_nearest_box_hit_loop}
+_jitted = {}
+
+def _compiled(name):
+    """ Returns the numba-compiled loop of a kernel, compiled at the first call. error_model='numpy' keeps the NumPy semantics of division by zero (inf) """
+    if name not in _jitted: _jitted[name] = numba.njit(error_model='numpy', cache=False)(_loops[name])
+    return _jitted[name]
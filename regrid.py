@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Regridding of spatial data between point sets.
+
+Microclimate inputs (CFD wind fields, TUF-IOBES surface data, Tmrt results) rarely share coordinates with the pedestrian keys at which SET is calculated.
+Instead of searching around every key for every field (pdcoord.val_at_coord), a Regridder computes the interpolation weights from a set of source points
+to a set of target keys once, and stores them as a sparse matrix. Mapping a field is then a single sparse matrix-vector product, so that the same weights can be
+reused for every hour of a time series.
+
+Methods:
+    'nearest' : value of the closest source point
+    'idw'     : inverse-distance weighting of the k closest source points
+    'linear'  : barycentric (linear) interpolation on the Delaunay triangulation of the source points
+    'box'     : mean of all source points within an axis-aligned box of half-width 'radius' (same selection as pdcoord.val_at_coord)
+"""
+import numpy as np
+import pandas as pd
+import scipy.sparse
+from scipy.spatial import cKDTree, Delaunay
+
+
+def frame_frm_input(data):
+    """ Returns the DataFrame of a pdcoord, and any other input unchanged """
+    if isinstance(getattr(data, 'data', None), pd.DataFrame): return data.data
+    return data
+
+def coords_frm_input(points, dims=2):
+    """ Returns an array of coordinates with 'dims' columns from a pdcoord, a DataFrame with x,y,z columns, or a numpy array of (X,Y,Z) points """
+    points = frame_frm_input(points)
+    if isinstance(points, pd.DataFrame):
+        points = points[['x','y','z']].values
+    points = np.asarray(points, dtype=float)
+    if points.ndim == 1: points = points.reshape(1,-1)
+    return points[:,:dims]
+
+class Regridder(object):
+    """ Precomputed interpolation weights from the points of a source pdcoord to a set of target keys.
+    Usage:
+        wind_to_ped = Regridder(windpdcoord, pedkeys, method='linear')
+        wind_at_keys = wind_to_ped(windpdcoord)   # or wind_to_ped(np.array of values), also for (Nsource x Nfields) arrays
+    dims = 2 interpolates in the horizontal plane (data at pedestrian height), dims = 3 uses x,y,z.
+    Target keys that are outside of the source data (outside of the convex hull for 'linear', no point within the radius for 'box' or 'idw') are
+    NaN, unless outside='nearest' in which case the nearest source value is used. """
+
+    def __init__(self, source, target, method='linear', dims=2, k=4, power=2., radius=None, outside='nan'):
+        self.source = coords_frm_input(source, dims)
+        self.target = coords_frm_input(target, dims)
+        self.method = method
+        self.dims = dims
+        if method == 'nearest': rows, cols, weights = self._nearest(np.arange(len(self.target)))
+        elif method == 'idw': rows, cols, weights = self._idw(k, power, radius)
+        elif method == 'linear': rows, cols, weights = self._linear()
+        elif method == 'box': rows, cols, weights = self._box(1. if radius is None else radius)
+        else: raise ValueError("Regridder method must be one of 'nearest', 'idw', 'linear' or 'box'")
+
+        if outside == 'nearest': #fill targets that did not receive any weight with the nearest source value
+            missing = np.setdiff1d(np.arange(len(self.target)), rows)
+            if missing.size:
+                mrows, mcols, mweights = self._nearest(missing)
+                rows, cols, weights = [np.concatenate(pair) for pair in zip((rows,cols,weights),(mrows,mcols,mweights))]
+        self.covered = np.zeros(len(self.target),dtype=bool); self.covered[rows] = True
+        self.weights = scipy.sparse.csr_matrix((weights,(rows,cols)), shape=(len(self.target),len(self.source)))
+
+    def _nearest(self, targets):
+        dist, idx = cKDTree(self.source).query(self.target[targets])
+        return targets, idx, np.ones(len(targets))
+
+    def _idw(self, k, power, radius):
+        k = min(k, len(self.source))
+        dist, idx = cKDTree(self.source).query(self.target, k=k, distance_upper_bound=np.inf if radius is None else radius)
+        dist = dist.reshape(len(self.target),k); idx = idx.reshape(len(self.target),k)
+        found = np.isfinite(dist)
+        exact = (dist == 0).any(axis=1) #target coincides with a source point: take that value only
+        with np.errstate(divide='ignore'):
+            weights = np.where(found, 1./dist**power, 0.)
+        weights[exact] = (dist[exact] == 0).astype(float)
+        total = weights.sum(axis=1)
+        valid = total > 0
+        weights[valid] = weights[valid]/total[valid,None]
+        keep = found & (weights > 0)
+        rows = np.repeat(np.arange(len(self.target)),k).reshape(-1,k)
+        return rows[keep], idx[keep], weights[keep]
+
+    def _linear(self):
+        tri = Delaunay(self.source)
+        simplex = tri.find_simplex(self.target)
+        inside = np.nonzero(simplex >= 0)[0]
+        transform = tri.transform[simplex[inside]] #affine transform to barycentric coordinates of each containing simplex
+        bary = np.einsum('ijk,ik->ij', transform[:,:self.dims,:], self.target[inside] - transform[:,self.dims,:])
+        bary = np.hstack([bary, 1. - bary.sum(axis=1, keepdims=True)])
+        rows = np.repeat(inside, self.dims+1)
+        cols = tri.simplices[simplex[inside]].ravel()
+        return rows, cols, bary.ravel()
+
+    def _box(self, radius):
+        neighbours = cKDTree(self.source).query_ball_point(self.target, radius, p=np.inf) #Chebyshev distance = axis-aligned box
+        counts = np.array([len(n) for n in neighbours])
+        rows = np.repeat(np.arange(len(self.target)), counts)
+        cols = np.array([i for n in neighbours for i in n], dtype=int)
+        return rows, cols, 1./counts[rows]
+
+    def __call__(self, values):
+        """ Returns the values at the target keys. values can be a pdcoord (its v column is used), a 1D array with one value per source point, or a 2D array of several fields. """
+        values = frame_frm_input(values)
+        if isinstance(values, pd.DataFrame): values = values.v.values
+        values = np.asarray(values, dtype=float)
+        result = self.weights.dot(values)
+        result[~self.covered] = np.nan
+        return result
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Headless batch rendering of pdcoords into image files.
+
+pdcoord.contour() and scatter3d() build a new interactive figure for every call, interpolate again and draw every point, which is too slow for hundreds
+of hourly maps. A FrameRenderer is set up once for a set of keys: the image grid, the interpolation (or binning) weights from the keys to the pixels
+(see regrid.Regridder) and a figure on the Agg backend (no window, no pyplot state). Each frame then only applies the weights to the new values, updates
+the image data and title, and writes the file.
+    - method='linear' or 'nearest' interpolates 2-D data (e.g. Tmrt or SET at pedestrian height) onto the pixel centres,
+    - method='bin' averages (or takes the maximum of, with reduce='max') all points within each pixel, which also decimates large 3-D point clouds
+      (e.g. surface data) into a top view.
+render_sequence() renders a list of frames on a pool of processes, each with its own FrameRenderer.
+
+Example:
+    frames = [(config['name']+'_SET_%03d.png' % hour, SET[hour], 'SET hour %d' % hour) for hour in range(240)]
+    render.render_sequence(pedkeys, frames, cellsize=0.5, vmin=20, vmax=40, cbartitle='SET')
+"""
+import multiprocessing
+
+import numpy as np
+import scipy.sparse
+import matplotlib
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import matplotlib.patches as patches
+from matplotlib.path import Path
+
+import regrid
+import ExtraFunctions
+
+
+def bin_weights(points, xedges, yedges, reduce='mean'):
+    """ Returns a sparse (pixels x points) matrix that averages the points within each pixel of the grid (xedges, yedges), pixels ordered row by row along x.
+    With reduce='max', returns the pixel index of every point instead (-1 outside of the grid), for np.maximum.at """
+    points = np.asarray(points,dtype=float)
+    ix = np.searchsorted(xedges, points[:,0], 'right') - 1
+    iy = np.searchsorted(yedges, points[:,1], 'right') - 1
+    ix[points[:,0] == xedges[-1]] = len(xedges) - 2; iy[points[:,1] == yedges[-1]] = len(yedges) - 2 #points on the last edges belong to the last pixels
+    inside = (ix >= 0) & (ix < len(xedges)-1) & (iy >= 0) & (iy < len(yedges)-1)
+    pixel = np.where(inside, iy*(len(xedges)-1) + ix, -1)
+    if reduce == 'max': return pixel
+    counts = np.bincount(pixel[inside], minlength=(len(xedges)-1)*(len(yedges)-1)).astype(float)
+    cols = np.nonzero(inside)[0]
+    return scipy.sparse.csr_matrix((1./counts[pixel[inside]], (pixel[inside], cols)), shape=(len(counts), len(points)))
+
+class FrameRenderer(object):
+    """ Renders values at fixed keys into image files, reusing the image grid, the interpolation weights and the figure for every frame (see module description).
+    cellsize is the pixel size in model units (by default, 400 pixels along the longer side of the extent (xmin,xmax,ymin,ymax) of the keys).
+    model (a compound) or footprints (lists of x,y vertices, e.g. ExtraFunctions.footprints_frm_boxes) are drawn in white over the image. """
+
+    def __init__(self, keys, cellsize=None, extent=None, method='linear', reduce='mean', vmin=None, vmax=None, cmap='rainbow',
+                 title='', cbartitle='', figsize=(8,6), dpi=100, footprints=None, model=None):
+        keys = regrid.coords_frm_input(keys, dims=2)
+        if extent is None: extent = (keys[:,0].min(), keys[:,0].max(), keys[:,1].min(), keys[:,1].max())
+        if cellsize is None: cellsize = max(extent[1]-extent[0], extent[3]-extent[2])/400.
+        xedges = np.arange(extent[0], extent[1] + cellsize, cellsize); yedges = np.arange(extent[2], extent[3] + cellsize, cellsize)
+        self.shape = (len(yedges)-1, len(xedges)-1) #image rows along y
+        self.method, self.reduce = method, reduce
+        if method == 'bin': self.weights = bin_weights(keys, xedges, yedges, reduce)
+        else:
+            X, Y = np.meshgrid((xedges[:-1]+xedges[1:])/2., (yedges[:-1]+yedges[1:])/2.)
+            self.weights = regrid.Regridder(keys, np.column_stack([X.ravel(),Y.ravel()]), method=method)
+
+        self.figure = Figure(figsize=figsize, dpi=dpi)
+        self.canvas = FigureCanvasAgg(self.figure)
+        ax = self.figure.add_subplot(111)
+        self.image = ax.imshow(np.ma.masked_all(self.shape), origin='lower', extent=(xedges[0],xedges[-1],yedges[0],yedges[-1]),
+                               cmap=matplotlib.cm.get_cmap(cmap), vmin=vmin, vmax=vmax, interpolation='nearest')
+        self.title = ax.set_title(title)
+        self.autoscale = vmin is None or vmax is None
+        cbar = self.figure.colorbar(self.image); cbar.ax.set_ylabel(cbartitle)
+        if model is not None: footprints = ExtraFunctions.footprints_frm_compound(model)
+        for footprint in footprints or []:
+            ax.add_patch(patches.PathPatch(Path(np.asarray(footprint)[:,:2], closed=True), facecolor='white', lw=0))
+        ax.set_xlabel('X axis'); ax.set_ylabel('Y axis')
+
+    def raster(self, values):
+        """ Returns the image (rows along y) of the values at the keys, masked where there is no data """
+        values = regrid.frame_frm_input(values)
+        values = np.asarray(getattr(values, 'v', values), dtype=float)
+        if self.method == 'bin' and self.reduce == 'max':
+            image = np.empty(self.shape[0]*self.shape[1]); image.fill(-np.inf)
+            inside = self.weights >= 0
+            np.maximum.at(image, self.weights[inside], values[inside])
+            image[np.isinf(image)] = np.nan
+        elif self.method == 'bin':
+            image = self.weights.dot(values)
+            image[np.asarray(self.weights.sum(axis=1)).ravel() == 0] = np.nan
+        else: image = self.weights(values)
+        return np.ma.masked_invalid(image.reshape(self.shape))
+
+    def render(self, values, filename, title=None):
+        """ Draws the values at the keys (array or pdcoord in the order of the keys) and writes the image to filename """
+        image = self.raster(values)
+        self.image.set_data(image)
+        if self.autoscale and image.count(): self.image.set_clim(image.min(), image.max())
+        if title is not None: self.title.set_text(title)
+        self.canvas.print_figure(filename, dpi=self.figure.dpi)
+        return filename
+
+_worker = {} #FrameRenderer of each process of render_sequence()
+
+def _start_worker(keys, options):
+    _worker['renderer'] = FrameRenderer(keys, **options)
+
+def _render_frame(frame):
+    filename, values, title = frame
+    return _worker['renderer'].render(values, filename, title)
+
+def render_sequence(keys, frames, processes=None, **options):
+    """ Renders frames, a list of (filename, values, title), with FrameRenderers for keys (options as for FrameRenderer) on a pool of processes (one process if processes=1).
+    Returns the list of filenames """
+    frames = [(filename, np.asarray(getattr(regrid.frame_frm_input(values), 'v', values), dtype=float), title) for filename, values, title in frames]
+    if processes == 1:
+        _start_worker(keys, options)
+        return [_render_frame(frame) for frame in frames]
+    processes = processes or multiprocessing.cpu_count() #the default of multiprocessing.Pool
+    pool = multiprocessing.Pool(processes, _start_worker, (keys, options))
+    try: return pool.map(_render_frame, frames, chunksize=max(1, len(frames)//(4*processes)))
+    finally: pool.close(); pool.join()
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+Chunked, compressed storage of Tmrt, SET, SVF, sunlit etc. at the pedestrian keys over time.
+
+A ResultCube is a folder with
+    - metadata.json: variables, time labels, chunk sizes and the bounding box of each chunk of keys,
+    - keys.npy: the x,y,z coordinates of the keys, sorted along a Z-order curve so that nearby keys are stored together,
+    - order.npy: the position of each stored key in the key set given when the cube was created,
+    - <variable>/<time chunk>_<key chunk>.npz: compressed (time x key) blocks of values.
+Results are appended one time step at a time and written chunk by chunk. read() and slice() load only the chunks that overlap the requested times and
+region, so that one hour or one street is read without reading the whole cube. Values are stored as float32 by default.
+
+Example:
+    cube = resultcube.ResultCube(config['name']+'_results', pedkeys, variables=['TMRT','SET'])
+    cube.append(hour, {'TMRT':TMRT, 'SET':SET})    # pdcoords or arrays in the order of pedkeys
+    cube.flush()
+    TMRT_noon = thermalcomfort.pdcoord_from_cube(config['name']+'_results', 'TMRT', 12, region=(xmin,ymin,xmax,ymax))
+"""
+import os
+import json
+import shutil
+
+import numpy as np
+import pandas as pd
+
+import regrid
+
+
+def spatial_order(keys, bits=16):
+    """ Returns the permutation that sorts the keys along a Z-order (Morton) curve of their x,y coordinates """
+    xy = np.asarray(keys,dtype=float)[:,:2]
+    span = np.maximum(xy.max(axis=0) - xy.min(axis=0), 1e-12)
+    cells = ((xy - xy.min(axis=0))/span*(2**bits-1)).astype(np.uint64)
+    code = np.zeros(len(xy), dtype=np.uint64)
+    for bit in range(bits): #interleave the bits of the x and y cells
+        code |= ((cells[:,0] >> np.uint64(bit)) & np.uint64(1)) << np.uint64(2*bit)
+        code |= ((cells[:,1] >> np.uint64(bit)) & np.uint64(1)) << np.uint64(2*bit+1)
+    return np.argsort(code, kind='mergesort')
+
+class ResultCube(object):
+    """ Folder of chunked (time x key) results (see module description).
+    To create a new cube, give the keys (array of x,y,z, e.g. pedkeys) and the variables; to open an existing one, give only its path.
+    mode sets what happens when keys are given and a cube already exists at path: 'create' raises IOError, 'overwrite' replaces it, and 'append'
+    reopens it (the keys must be the same, in the same order) to add further time steps. """
+
+    def __init__(self, path, keys=None, variables=['TMRT','SET'], chunk_time=24, chunk_keys=4096, dtype='float32', mode='create'):
+        self.path = path
+        if keys is not None and os.path.exists(os.path.join(path,'metadata.json')):
+            if mode == 'create': raise IOError('ResultCube already exists at ' + path + "; use mode='overwrite' or 'append'")
+            elif mode == 'overwrite': self._remove()
+            elif mode == 'append':
+                existing = np.load(os.path.join(path,'keys.npy'))[np.argsort(np.load(os.path.join(path,'order.npy')))] #keys in the order given at creation
+                if not np.array_equal(existing, np.asarray(keys,dtype=float)): #append() maps values to keys by that order
+                    raise ValueError('The keys differ from those of the ResultCube at ' + path + ' (they must be the same keys in the same order)')
+                keys = None
+            else: raise ValueError('Unknown mode ' + mode)
+        if keys is not None:
+            keys = np.asarray(keys,dtype=float)
+            order = spatial_order(keys)
+            if not os.path.isdir(path): os.makedirs(path)
+            np.save(os.path.join(path,'keys.npy'), keys[order])
+            np.save(os.path.join(path,'order.npy'), order)
+            bounds = [np.r_[keys[order[k:k+chunk_keys],:2].min(axis=0), keys[order[k:k+chunk_keys],:2].max(axis=0)].tolist() for k in range(0,len(keys),chunk_keys)]
+            self.meta = {'variables':list(variables), 'times':[], 'chunk_time':chunk_time, 'chunk_keys':chunk_keys, 'nkeys':len(keys), 'dtype':dtype, 'key_chunk_bounds':bounds}
+            for variable in variables: os.makedirs(os.path.join(path,variable))
+            self._write_meta()
+        else:
+            with open(os.path.join(path,'metadata.json')) as metafile: self.meta = json.load(metafile)
+        self.keys = np.load(os.path.join(path,'keys.npy'), mmap_mode='r')
+        self.order = np.load(os.path.join(path,'order.npy'), mmap_mode='r')
+        self.variables = self.meta['variables']
+        self._rows = dict((variable, []) for variable in self.variables) #rows of the current (last, possibly incomplete) time chunk
+        self._dirty = False
+        partial = len(self.meta['times']) % self.meta['chunk_time']
+        if partial: #reopened with an incomplete last time chunk: continue filling it
+            for variable in self.variables: self._rows[variable] = list(self._load(variable, len(self.meta['times'])//self.meta['chunk_time'], None))
+
+    def __enter__(self): return self
+    def __exit__(self, *exc): self.flush()
+
+    @property
+    def times(self):
+        return self.meta['times']
+
+    def _remove(self):
+        """ Deletes the files of the cube at path (other files in the folder are kept) """
+        with open(os.path.join(self.path,'metadata.json')) as metafile: variables = json.load(metafile)['variables']
+        for variable in variables:
+            if os.path.isdir(os.path.join(self.path,variable)): shutil.rmtree(os.path.join(self.path,variable))
+        for name in ['keys.npy','order.npy','metadata.json']:
+            if os.path.exists(os.path.join(self.path,name)): os.remove(os.path.join(self.path,name))
+
+    def _write_meta(self):
+        tmpname = os.path.join(self.path,'metadata.json.tmp')
+        with open(tmpname,'w') as metafile: json.dump(self.meta, metafile)
+        if os.path.exists(os.path.join(self.path,'metadata.json')): os.remove(os.path.join(self.path,'metadata.json')) #os.rename does not overwrite on Windows
+        os.rename(tmpname, os.path.join(self.path,'metadata.json'))
+
+    def _chunkfile(self, variable, tchunk, kchunk):
+        return os.path.join(self.path, variable, '%d_%d.npz' % (tchunk, kchunk))
+
+    def _load(self, variable, tchunk, kchunks):
+        """ Values of one time chunk for the given key chunks (all if None), as a (time x key) array in stored key order """
+        if kchunks is None: kchunks = range(len(self.meta['key_chunk_bounds']))
+        blocks = []
+        for kchunk in kchunks:
+            with np.load(self._chunkfile(variable, tchunk, kchunk)) as chunk: blocks.append(chunk['v'])
+        return np.hstack(blocks)
+
+    def append(self, time, values):
+        """ Adds the results of one time step. values is a dictionary of pdcoords or arrays in the order of the keys given when the cube was created.
+        Variables that are not given are stored as NaN. Complete time chunks are written as soon as they are filled. """
+        if str(time) in self.meta['times']: raise ValueError('Time %s is already in the cube' % time)
+        for variable in values:
+            if variable not in self.variables: raise KeyError('Unknown variable ' + variable)
+        for variable in self.variables:
+            row = np.empty(self.meta['nkeys']); row.fill(np.nan)
+            if variable in values:
+                value = regrid.frame_frm_input(values[variable])
+                value = np.asarray(value.v.values if isinstance(value, pd.DataFrame) else value, dtype=float)
+                if len(value) != self.meta['nkeys']: raise ValueError('%s has %d values for %d keys' % (variable, len(value), self.meta['nkeys']))
+                row = value[self.order]
+            self._rows[variable].append(row.astype(self.meta['dtype']))
+        self.meta['times'].append(str(time))
+        self._dirty = True
+        if len(self._rows[self.variables[0]]) == self.meta['chunk_time']:
+            self.flush()
+            self._rows = dict((variable, []) for variable in self.variables)
+
+    def flush(self):
+        """ Writes the current time chunk (also if incomplete) and the metadata """
+        if not self._dirty: return
+        tchunk = (len(self.meta['times'])-1)//self.meta['chunk_time']
+        size = self.meta['chunk_keys']
+        for variable in self.variables:
+            block = np.array(self._rows[variable], dtype=self.meta['dtype'])
+            for kchunk in range(len(self.meta['key_chunk_bounds'])):
+                tmpname = self._chunkfile(variable, tchunk, kchunk) + '.tmp'
+                with open(tmpname,'wb') as chunkfile: np.savez_compressed(chunkfile, v=block[:,kchunk*size:(kchunk+1)*size])
+                if os.path.exists(self._chunkfile(variable, tchunk, kchunk)): os.remove(self._chunkfile(variable, tchunk, kchunk))
+                os.rename(tmpname, self._chunkfile(variable, tchunk, kchunk))
+        self._write_meta()
+        self._dirty = False
+
+    def read(self, variable, times=None, region=None):
+        """ Reads the values of a variable at the given time labels (all if None) within region = (xmin,ymin,xmax,ymax) (all keys if None).
+        Returns the time labels, the x,y,z of the selected keys, and a (time x key) array. Only the chunks that overlap the selection are loaded. """
+        self.flush()
+        labels = self.meta['times'] if times is None else [str(t) for t in times]
+        tindex = [self.meta['times'].index(label) for label in labels]
+        bounds = np.array(self.meta['key_chunk_bounds']).reshape(-1,4)
+        if region is None: kchunks = range(len(bounds))
+        else: kchunks = list(np.nonzero((bounds[:,0] <= region[2]) & (bounds[:,2] >= region[0]) & (bounds[:,1] <= region[3]) & (bounds[:,3] >= region[1]))[0])
+        size, ctime = self.meta['chunk_keys'], self.meta['chunk_time']
+        keyindex = np.hstack([np.arange(k*size, min((k+1)*size, self.meta['nkeys'])) for k in kchunks] + [np.zeros(0,dtype=int)])
+        keys = np.asarray(self.keys[keyindex])
+        values = np.empty((len(tindex), len(keyindex)))
+        for tchunk in sorted(set(t//ctime for t in tindex)):
+            block = self._load(variable, tchunk, kchunks) if kchunks else np.zeros((ctime,0))
+            for n, t in enumerate(tindex):
+                if t//ctime == tchunk: values[n] = block[t - tchunk*ctime]
+        if region is not None: #drop the keys of the loaded chunks that lie outside of the region
+            inside = (keys[:,0] >= region[0]) & (keys[:,0] <= region[2]) & (keys[:,1] >= region[1]) & (keys[:,1] <= region[3])
+            keys, values = keys[inside], values[:,inside]
+        return labels, keys, values
+
+    def slice(self, variable, time, region=None):
+        """ Returns a DataFrame of x,y,z,v of a variable at one time, to be used as pdcoord(cube.slice(...)) """
+        labels, keys, values = self.read(variable, [time], region)
+        return pd.DataFrame(np.column_stack([keys, values[0]]), columns=['x','y','z','v'])
+
+    def series(self, variable, key, radius=1):
+        """ Returns a Series of the mean value over time of the keys within radius of key (x,y) """
+        labels, keys, values = self.read(variable, None, (key[0]-radius, key[1]-radius, key[0]+radius, key[1]+radius))
+        return pd.Series(values.mean(axis=1), index=labels)
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Long-running comfort query service.
+
+A design tool that asks for Tmrt or SET at a few points after every change should not pay for importing the modules, building the model and tracing
+rays at every request. ComfortService loads the model, surface data and solar parameters once and keeps in memory
+    - the rays traced at every key queried so far (viewcache.ViewFactorCache),
+    - the shadow at every key for the current sun,
+    - the all_mrt() results at every key for the current model, surface data and sun, and the SET of every (air temperature, wind, Tmrt) queried.
+update_model() re-traces only the rays affected by the buildings that changed (see viewcache.py), and update_conditions() replaces the surface data or
+the solar parameters; the results that depend on them are dropped from the caches.
+
+serve() answers JSON queries over HTTP on a local port, each request in its own thread. Calculations share the caches and run one at a time (OCC is not
+thread-safe), while cached results are returned without waiting for the calculation lock.
+    POST /tmrt  {"keys": [[x,y,z], ...]}                                  -> {"results": [{"x":..,"y":..,"z":..,"TMRT":..,"SVF":..,"sunlit":..}, ...]}
+    POST /set   {"keys": [[x,y,z], ...], "wind": [..] or v, "Tair": Ta}   -> the same, with "SET"
+    GET  /status                                                           -> numbers of cached keys and of requests
+See Examples/Service_LoadTest.py for latencies under concurrent requests.
+
+Example (after Step1_Model_SetUp):
+    comfort = service.ComfortService(config['model'], config['Tair'], config['Refl'], config['Tsurf'], solarparam, model_inputs, ped_properties, gridsize=3)
+    server = service.serve(comfort, port=8765)
+    server.serve_forever()
+"""
+import json
+import threading
+import time
+import BaseHTTPServer
+import SocketServer
+
+import numpy as np
+import pandas as pd
+
+import thermalcomfort
+import viewcache
+
+
+class ComfortService(object):
+    """ Model, surface data and solar parameters with warm caches of view factors, shadow and Tmrt at the keys queried so far """
+
+    def __init__(self, model, pdAirTemp, pdReflect, pdSurfTemp, solarparam, model_inputs, ped_properties, gridsize=1, Ndir=200):
+        self.cache = viewcache.ViewFactorCache(model, Ndir)
+        self.pdAirTemp, self.pdReflect, self.pdSurfTemp, self.solarparam = pdAirTemp, pdReflect, pdSurfTemp, solarparam
+        self.model_inputs, self.ped_properties, self.gridsize = model_inputs, ped_properties, gridsize
+        self.shadows = {} #key: shadow (0 shaded, 1 sunlit) for the current sun
+        self.results = {} #key: all_mrt() results for the current model and conditions
+        self.sets = {} #(air temperature, wind speed, Tmrt): SET
+        self.lock = threading.RLock()
+        self.counter = threading.Lock() #for the request count only, so that cached queries do not wait for calculations
+        self.requests = 0
+
+    def mrt(self, key):
+        """ Returns the all_mrt() results at key as a dictionary, from the cache if available """
+        key = tuple(float(c) for c in key)
+        result = self.results.get(key) #one lookup: update_conditions() may replace the dictionary at any time
+        if result is not None: return result
+        with self.lock:
+            if key not in self.results:
+                if key not in self.shadows: self.shadows[key] = thermalcomfort.check_shadow(key, self.cache.model, self.solarparam.solarvector[0])
+                result = thermalcomfort.all_mrt(key,self.cache.model,self.pdAirTemp,self.pdReflect,self.pdSurfTemp,self.solarparam,self.model_inputs,self.ped_properties,
+                                                gridsize=self.gridsize,viewfactors=self.cache.viewfactors(key),shadowint=self.shadows[key])
+                self.results[key] = dict((name, _plain(result[name][0])) for name in result.columns)
+            return self.results[key] #update_conditions() waits for the lock
+
+    def tmrt(self, keys):
+        """ Returns the list of all_mrt() results (dictionaries with x,y,z) at keys """
+        with self.counter: self.requests += 1
+        return [dict(self.mrt(key), x=float(key[0]), y=float(key[1]), z=float(key[2])) for key in keys]
+
+    def set(self, keys, wind, Tair=None):
+        """ Returns the all_mrt() results and SET at keys, for wind speeds at the keys (a list or one value) and air temperature Tair (by default the bulk or local air temperature of the service) """
+        results = self.tmrt(keys)
+        winds = np.resize(np.asarray(wind,dtype=float), len(results))
+        for result, windspeed in zip(results, winds):
+            if Tair is not None: Ta = Tair
+            elif isinstance(self.pdAirTemp, thermalcomfort.pdcoord): Ta = self.pdAirTemp.val_at_coord((result['x'],result['y'],result['z'])).v.mean()
+            else: Ta = self.pdAirTemp
+            inputs = (float(Ta), float(windspeed), result['TMRT'])
+            SET = self.sets.get(inputs)
+            if SET is None:
+                microclimate = pd.DataFrame({'T_air':[Ta], 'wind_speed':[windspeed], 'mean_radiant_temperature':[result['TMRT']], 'RH':[self.model_inputs.RH[0]]})
+                SET = self.sets[inputs] = _plain(thermalcomfort.calc_SET(microclimate, self.ped_properties.copy()))
+            result['SET'] = SET
+        return results
+
+    def update_model(self, newmodel):
+        """ Replaces the model and re-traces at once the rays of the cached keys affected by the change (see viewcache.py); their shadow and results are
+        recalculated at their next query. Returns the affected keys """
+        with self.lock:
+            affected = self.cache.update(newmodel, self.solarparam.solarvector[0])
+            for key in affected:
+                self.shadows.pop(key, None); self.results.pop(key, None)
+            return affected
+
+    def update_conditions(self, pdAirTemp=None, pdReflect=None, pdSurfTemp=None, solarparam=None):
+        """ Replaces the air temperature, surface data or solar parameters (e.g. for another hour). View factors are kept; results (and shadows, for a new sun) are dropped """
+        with self.lock:
+            if pdAirTemp is not None: self.pdAirTemp = pdAirTemp
+            if pdReflect is not None: self.pdReflect = pdReflect
+            if pdSurfTemp is not None: self.pdSurfTemp = pdSurfTemp
+            if solarparam is not None:
+                self.solarparam = solarparam; self.shadows = {}
+            self.results = {}; self.sets = {}
+
+    def status(self):
+        return {'keys_traced':len(self.cache.rays), 'keys_cached':len(self.results), 'SET_cached':len(self.sets), 'rays_traced':self.cache.traced, 'requests':self.requests}
+
+def _plain(value):
+    """ Converts numpy scalars to Python numbers for JSON """
+    if isinstance(value, (bool, np.bool_)): return bool(value)
+    return float(value)
+
+class ComfortRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Answers the JSON queries of serve() with the ComfortService of the server """
+
+    def _reply(self, code, body):
+        text = json.dumps(body)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(text)))
+        self.end_headers()
+        self.wfile.write(text)
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/status': self._reply(200, self.server.comfort.status())
+        else: self._reply(404, {'error':'unknown path ' + self.path})
+
+    def do_POST(self):
+        time1 = time.time()
+        try:
+            query = json.loads(self.rfile.read(int(self.headers.getheader('Content-Length', 0))) or '{}')
+            keys = query['keys']
+            if self.path.rstrip('/') == '/tmrt': results = self.server.comfort.tmrt(keys)
+            elif self.path.rstrip('/') == '/set': results = self.server.comfort.set(keys, query.get('wind', 0.), query.get('Tair'))
+            else: return self._reply(404, {'error':'unknown path ' + self.path})
+        except (ValueError, KeyError, TypeError, IndexError) as error:
+            return self._reply(400, {'error':'bad query: %r' % error})
+        self._reply(200, {'results':results, 'seconds':time.time()-time1})
+
+    def log_message(self, format, *args):
+        pass #one line per request on stderr would dominate the latency of cached queries
+
+class ComfortServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128 #the default of 5 makes concurrent clients wait for connection retries
+
+def serve(comfort, host='127.0.0.1', port=8765):
+    """ Returns an HTTP server answering queries with the ComfortService comfort (see module description). Call serve_forever() on it, or run it in a thread """
+    server = ComfortServer((host, port), ComfortRequestHandler)
+    server.comfort = comfort
+    print 'Comfort service listening on http://%s:%d' % (host, server.server_address[1])
+    return server
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Sharded execution of Tmrt and SET calculations.
+
+For city-scale models with many pedestrian keys, run_sharded() splits the keys into square spatial tiles ('shards'). Each shard is sent to a worker with
+the part of the model and of the surface data it needs, serialised so that it can cross process or machine boundaries (the model as an OCC BRep string,
+the data as DataFrames). Workers run all_mrt() (and calc_SET() if wind speeds are given) for the keys of their shard, and the outputs are merged back
+into pdcoords in the order of the keys. Failed shards are submitted again up to 'retries' times.
+
+With horizon=None, every shard receives the whole model and all surface data within gridsize of it, so the results are identical to calculating all
+keys in a single process. With a horizon, each shard only receives the buildings within the horizon of its tile (see culling.py), widened if needed
+to every building that can shade the tile at the solar elevation of solarparam (the shadow is traced against the same model).
+
+Backends run shards through submit(func, payload), which returns a task with a get(timeout) method:
+    - LocalProcessBackend (default) runs shards on a multiprocessing pool. run_sharded() stops the pool it creates before returning; to reuse one pool
+      across calls, pass a LocalProcessBackend and close() it when done (or use it in a with statement),
+    - InlineBackend runs them immediately in the calling process (a local stand-in for a task queue when testing),
+    - TaskQueueBackend wraps a task queue: TaskQueueBackend(celery_task.delay) for a Celery task that calls run_shard(payload).
+"""
+import os
+import sys
+import tempfile
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+
+from OCC.BRep import BRep_Builder
+from OCC.BRepTools import breptools_Read, breptools_Write
+from OCC.TopoDS import TopoDS_Shape
+
+import pyliburo
+import culling
+import thermalcomfort
+
+
+def shape_to_brep(shape):
+    """ Serialises an OCC shape into a BRep string """
+    handle, filename = tempfile.mkstemp(suffix='.brep'); os.close(handle)
+    try:
+        breptools_Write(shape, filename)
+        with open(filename) as brepfile: return brepfile.read()
+    finally: os.remove(filename)
+
+def shape_frm_brep(brep):
+    """ Rebuilds an OCC shape from a BRep string """
+    handle, filename = tempfile.mkstemp(suffix='.brep'); os.close(handle)
+    try:
+        with open(filename,'w') as brepfile: brepfile.write(brep)
+        shape = TopoDS_Shape()
+        breptools_Read(shape, filename, BRep_Builder())
+        return shape
+    finally: os.remove(filename)
+
+def make_shards(pedkeys, tilesize):
+    """ Splits the keys into square tiles of tilesize. Returns a list of arrays of key indices, one per non-empty tile """
+    tiles = np.floor(np.asarray(pedkeys,dtype=float)[:,:2]/tilesize).astype(int)
+    tile_ids, inverse = np.unique(tiles[:,0]*1000003 + tiles[:,1], return_inverse=True)
+    return [np.nonzero(inverse == n)[0] for n in range(len(tile_ids))]
+
+def _subset(data, bbox, margin):
+    """ Rows of a pdcoord within the horizontal bounding box (xmin,ymin,xmax,ymax) expanded by margin, as a DataFrame. Bulk values are returned unchanged """
+    if not isinstance(data, thermalcomfort.pdcoord): return data
+    df = data.data
+    return df[(df.x >= bbox[0]-margin) & (df.x <= bbox[2]+margin) & (df.y >= bbox[1]-margin) & (df.y <= bbox[3]+margin)]
+
+def _rebuild(data):
+    return thermalcomfort.pdcoord(data.copy()) if isinstance(data, pd.DataFrame) else data
+
+def run_shard(payload):
+    """ Worker function: calculates all_mrt() (and calc_SET() if payload['wind'] is given) at the keys of one shard.
+    Returns a DataFrame of the all_mrt() results (and SET) indexed by the positions of the keys in the full key set """
+    compound = shape_frm_brep(payload['model'])
+    pdAirTemp, pdReflect, pdSurfTemp = [_rebuild(payload[name]) for name in ('Tair','Reflect','SurfTemp')]
+    results = []
+    for n, key in enumerate(payload['keys']):
+        result = thermalcomfort.all_mrt(tuple(key),compound,pdAirTemp,pdReflect,pdSurfTemp,payload['solarparam'],payload['model_inputs'],payload['ped_properties'],gridsize=payload['gridsize'])
+        if payload['wind'] is not None:
+            Ta = pdAirTemp.val_at_coord(tuple(key)).v.mean() if isinstance(pdAirTemp, thermalcomfort.pdcoord) else pdAirTemp
+            microclimate = pd.DataFrame({'T_air':[Ta], 'wind_speed':[payload['wind'][n]], 'mean_radiant_temperature':[result.TMRT[0]], 'RH':[payload['model_inputs'].RH[0]]})
+            result['SET'] = thermalcomfort.calc_SET(microclimate, payload['ped_properties'].copy())
+        results.append(result)
+    results = pd.concat(results, ignore_index=True)
+    results.index = payload['index']
+    return results
+
+class _Finished(object):
+    """ Task that has already run, with the get() interface of multiprocessing's AsyncResult """
+    def __init__(self, func, payload):
+        try: self.value, self.error = func(payload), None
+        except Exception: self.value, self.error = None, sys.exc_info()
+    def get(self, timeout=None):
+        if self.error is not None: raise self.error[0], self.error[1], self.error[2]
+        return self.value
+
+class InlineBackend(object):
+    """ Runs each shard in the calling process as soon as it is submitted """
+    def submit(self, func, payload): return _Finished(func, payload)
+
+class LocalProcessBackend(object):
+    """ Runs shards on a pool of local processes. Call close() (or use it in a with statement) to stop the processes """
+    def __init__(self, processes=None):
+        self.pool = multiprocessing.Pool(processes)
+    def submit(self, func, payload): return self.pool.apply_async(func, (payload,))
+    def close(self, terminate=False):
+        """ Stops the processes when their tasks are done, or at once with terminate=True (e.g. after a timeout) """
+        if terminate: self.pool.terminate()
+        else: self.pool.close()
+        self.pool.join()
+    def __enter__(self): return self
+    def __exit__(self, *error): self.close(terminate=error[0] is not None)
+
+class TaskQueueBackend(object):
+    """ Runs shards through a task queue. enqueue(payload) must start run_shard(payload) on a worker and return a task with a get(timeout) method """
+    def __init__(self, enqueue):
+        self.enqueue = enqueue
+    def submit(self, func, payload): return self.enqueue(payload)
+
+def run_sharded(pedkeys, compound, pdAirTemp, pdReflect, pdSurfTemp, solarparam, model_inputs, ped_properties, gridsize=1, wind=None,
+                tilesize=50., horizon=None, backend=None, retries=2, timeout=None):
+    """ Calculates Tmrt (and SET if wind speeds at the keys are given) at pedkeys, split into shards of tilesize (see module description).
+    Returns a dictionary of pdcoords ('TMRT', and 'SET' if calculated) and the DataFrame of all results in the order of pedkeys """
+    pedkeys = np.asarray(pedkeys,dtype=float)
+    index = culling.FootprintIndex(compound) if horizon is not None else None
+    if horizon is not None: #buildings beyond the horizon can shade the keys when the sun is low
+        horizon = max(horizon, culling.horizon_distance(index.bboxes[:,5].max(), pedkeys[:,2].min(), 90., solarparam.solarvector[0]))
+    fullbrep = shape_to_brep(compound) if horizon is None else None
+    payloads = []
+    for shard in make_shards(pedkeys, tilesize):
+        keys = pedkeys[shard]
+        tile = np.hstack([keys[:,:2].min(axis=0), keys[:,:2].max(axis=0)])
+        if horizon is None: model, brep = compound, fullbrep
+        else:
+            model = index.local_model(((tile[0]+tile[2])/2., (tile[1]+tile[3])/2.), horizon + np.hypot(tile[2]-tile[0], tile[3]-tile[1])/2.)
+            brep = shape_to_brep(model)
+        bbox = pyliburo.py3dmodel.calculate.get_bounding_box(model)
+        modeltile = (min(bbox[0],tile[0]), min(bbox[1],tile[1]), max(bbox[3],tile[2]), max(bbox[4],tile[3]))
+        payloads.append({'index':shard, 'keys':keys, 'model':brep, 'gridsize':gridsize,
+                         'Tair':_subset(pdAirTemp, tile, 1.), 'Reflect':_subset(pdReflect, modeltile, gridsize), 'SurfTemp':_subset(pdSurfTemp, modeltile, gridsize),
+                         'solarparam':solarparam, 'model_inputs':model_inputs, 'ped_properties':ped_properties,
+                         'wind':None if wind is None else np.asarray(wind,dtype=float)[shard]})
+
+    owned = backend is None #a pool created here is stopped before returning
+    if owned: backend = LocalProcessBackend()
+    results = {}; pending = range(len(payloads))
+    try:
+        for attempt in range(retries+1):
+            tasks = [(n, backend.submit(run_shard, payloads[n])) for n in pending]
+            failed = []
+            for n, task in tasks:
+                try: results[n] = task.get(timeout)
+                except Exception as error:
+                    print 'Shard', n, 'failed (attempt', attempt+1, '):', error
+                    failed.append(n)
+            pending = failed
+            if not pending: break
+    finally:
+        if owned: backend.close(terminate=bool(pending))
+    if pending: raise RuntimeError('Shards %s failed after %d attempts' % (pending, retries+1))
+
+    merged = pd.concat([results[n] for n in range(len(payloads))]).sort_index()
+    output = {'TMRT':thermalcomfort.pdcoords_from_pedkeys(pedkeys, merged.TMRT.values)}
+    if wind is not None: output['SET'] = thermalcomfort.pdcoords_from_pedkeys(pedkeys, merged.SET.values)
+    return output, merged
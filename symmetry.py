@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Symmetry reduction of the pedestrian keys of regular building arrays (ExtraFunctions.makemodelmatrix, makemodelstagger).
+
+Around the central block of a regular array, many keys are mirror images of each other: they see the same buildings, the same surface data and the
+same sun, so that they have the same Tmrt. This module finds the symmetries of the configuration and calculates all_mrt() only for one key of each set of
+equivalent keys, then copies the results to the other keys.
+
+A symmetry is one of the 8 rotations/reflections of the square about a centre (by default the centre of the keys), or a translation by one period of the
+array. It is used only if it maps
+    - the keys onto themselves,
+    - the buildings onto themselves (compared by their bounding boxes, as they are in the model),
+    - the solar vector onto itself (any horizontal symmetry for an overhead sun, only the reflection about the solar azimuth otherwise),
+    - each of the given surface data pdcoords onto itself (same value at the image of each point, where the image lies within the data).
+For a square cube array with an overhead sun, this reduces the number of all_mrt() calls by up to 8 times; the 5 x 3 array of Examples/Step1_Model_SetUp.py
+only has the 4 symmetries of a rectangle (576 keys reduce to 153). Note that the discretized sphere of fourpiradiation() is not exactly symmetric, so the
+Tmrt of mirror keys calculated separately differs by the sampling noise of the Ndir directions.
+
+Translations need a period (px,py), and treat the array as infinitely repeated (as repeat_outset() does for the surface data). all_mrt() traces the
+rays against the finite model, in which a key and its translated image see different buildings towards the edges of the array, so the results copied
+by translation are an approximation, and a warning is printed. Rotations and reflections are always checked against the buildings of the model.
+Translations only help when the keys span more than one period: the keys of Examples/Step1_Model_SetUp.py cover one 15 m square, which a translation by
+one period maps onto no other key.
+
+Example (after Step1_Model_SetUp):
+    TMRT = symmetry.symmetric_mrt(pedkeys, compound, Tair, pdReflect, pdTs, solarparam, model_inputs, ped_properties, gridsize=3)
+"""
+import numpy as np
+from scipy.spatial import cKDTree
+
+import ExtraFunctions
+import thermalcomfort
+
+SQUARE_GROUP = {'identity':np.eye(2), 'rotate90':np.array([[0,-1],[1,0]]), 'rotate180':-np.eye(2), 'rotate270':np.array([[0,1],[-1,0]]),
+                'mirror_x':np.array([[-1,0],[0,1]]), 'mirror_y':np.array([[1,0],[0,-1]]), 'mirror_xy':np.array([[0,1],[1,0]]), 'mirror_antixy':np.array([[0,-1],[-1,0]])}
+
+def transform_points(points, matrix, centre, shift=(0,0)):
+    """ Applies the 2x2 matrix about centre, then the shift, to the x,y columns of an array of points """
+    points = np.array(points,dtype=float)
+    points[:,:2] = np.asarray(centre) + (points[:,:2] - np.asarray(centre)).dot(np.asarray(matrix,dtype=float).T) + np.asarray(shift)
+    return points
+
+def transform_bboxes(bboxes, matrix, centre):
+    """ Applies the 2x2 matrix about centre to axis-aligned bounding boxes (xmin,ymin,zmin,xmax,ymax,zmax) """
+    corners = [transform_points(bboxes[:,cols], matrix, centre) for cols in ([0,1,2],[3,4,5])]
+    return np.hstack([np.minimum(*corners), np.maximum(*corners)])
+
+def _box_signatures(bboxes, decimals=4):
+    """ Set of rounded bounding boxes """
+    return set(tuple(row) for row in np.round(bboxes,decimals) + 0.) # + 0. turns -0. into 0.
+
+def _maps_points(points, matrix, centre, tol, shift=(0,0), values=None, vtol=1e-6):
+    """ True if the transform maps every point (within the extent of the points) onto a point of the same set, with the same value if values are given """
+    points = np.asarray(points,dtype=float)
+    image = transform_points(points, matrix, centre, shift)
+    inside = np.all((image >= points.min(axis=0) - tol) & (image <= points.max(axis=0) + tol), axis=1)
+    dist, idx = cKDTree(points).query(image[inside])
+    if (dist > tol).any(): return False
+    return values is None or np.allclose(values[inside], values[idx], atol=vtol, equal_nan=True)
+
+def find_symmetries(pedkeys, bboxes, solarvector, centre=None, period=None, fields=[], tol=1e-3):
+    """ Returns the list of (name, matrix, centre, shift) of the symmetries of the configuration (see module description).
+    bboxes are the bounding boxes of the buildings (ExtraFunctions.bboxes_frm_compound(model)[1] or makemodel_frmcsv(...)["boxes"]).
+    period = (px,py) adds the translations by one period (an approximation for finite models, see module description); fields are pdcoords of surface
+    (or air) data that must also be symmetric. """
+    pedkeys = np.asarray(pedkeys,dtype=float); bboxes = np.asarray(bboxes,dtype=float).reshape(-1,6)
+    if centre is None: centre = (pedkeys[:,:2].min(axis=0) + pedkeys[:,:2].max(axis=0))/2.
+    signatures = _box_signatures(bboxes)
+    symmetries = []
+    for name, matrix in sorted(SQUARE_GROUP.items()):
+        if not np.allclose(matrix.dot(solarvector[:2]), solarvector[:2], atol=tol): continue
+        if _box_signatures(transform_bboxes(bboxes, matrix, centre)) != signatures: continue
+        if not _maps_points(pedkeys, matrix, centre, tol): continue
+        if not all(_maps_points(field.data[['x','y','z']].values, matrix, centre, tol, values=field.data.v.values) for field in fields): continue
+        symmetries.append((name, matrix, centre, (0.,0.)))
+    if period is not None: #translations by one period, where they map keys onto keys
+        print 'Warning: translations by the period treat the array as infinitely repeated; for a finite model, results copied by translation are approximate.'
+        for shift in [(period[0],0.),(0.,period[1])]:
+            if all(_maps_points(field.data[['x','y','z']].values, np.eye(2), centre, tol, shift, field.data.v.values) for field in fields):
+                symmetries.append(('translate_x' if shift[0] else 'translate_y', np.eye(2), centre, shift))
+    return symmetries
+
+def irreducible_keys(pedkeys, symmetries, tol=1e-3):
+    """ Groups the keys that are images of each other under the symmetries.
+    Returns the indices of one representative key per group, and for every key the index of its representative """
+    pedkeys = np.asarray(pedkeys,dtype=float)
+    parent = np.arange(len(pedkeys))
+    def root(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]; i = parent[i]
+        return i
+    tree = cKDTree(pedkeys)
+    for name, matrix, centre, shift in symmetries:
+        dist, idx = tree.query(transform_points(pedkeys, matrix, centre, shift))
+        for i, j in zip(np.nonzero(dist <= tol)[0], idx[dist <= tol]):
+            a, b = root(i), root(j)
+            if a != b: parent[max(a,b)] = min(a,b)
+    representative = np.array([root(i) for i in range(len(pedkeys))])
+    return np.unique(representative), representative
+
+def symmetric_mrt(pedkeys, compound, pdAirTemp, pdReflect, pdSurfTemp, solarparam, model_inputs, ped_properties, gridsize=1, centre=None, period=None):
+    """ Calculates Tmrt at pedkeys with all_mrt(), only at one key of each set of symmetric keys. Returns a pdcoord of Tmrt at all pedkeys.
+    Surface and air data given as pdcoords must be symmetric too, otherwise the corresponding symmetries are not used. """
+    pedkeys = np.asarray(pedkeys,dtype=float)
+    fields = [data for data in (pdAirTemp, pdReflect, pdSurfTemp) if isinstance(data, thermalcomfort.pdcoord)]
+    symmetries = find_symmetries(pedkeys, ExtraFunctions.bboxes_frm_compound(compound)[1], solarparam.solarvector[0], centre, period, fields)
+    keys, representative = irreducible_keys(pedkeys, symmetries)
+    print 'Symmetries:', [s[0] for s in symmetries], '|', len(keys), 'of', len(pedkeys), 'keys calculated'
+    TMRT = dict((i, thermalcomfort.all_mrt(tuple(pedkeys[i]),compound,pdAirTemp,pdReflect,pdSurfTemp,solarparam,model_inputs,ped_properties,gridsize=gridsize).TMRT[0]) for i in keys)
+    return thermalcomfort.pdcoords_from_pedkeys(pedkeys, np.array([TMRT[i] for i in representative]))
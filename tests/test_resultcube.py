@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+""" Appending to an existing ResultCube must keep every value under its own key. """
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import resultcube
+
+
+class AppendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'cube')
+        self.keys = np.random.RandomState(0).rand(50,3)*100
+        cube = resultcube.ResultCube(self.path, self.keys, variables=['TMRT'], chunk_time=4)
+        for hour in range(3): cube.append(hour, {'TMRT':self.keys[:,0] + hour})
+        cube.flush()
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.path))
+
+    def test_same_keys_round_trip(self):
+        cube = resultcube.ResultCube(self.path, self.keys, variables=['TMRT'], chunk_time=4, mode='append')
+        for hour in range(3,6): cube.append(hour, {'TMRT':self.keys[:,0] + hour})
+        cube.flush()
+        labels, keys, values = resultcube.ResultCube(self.path).read('TMRT')
+        self.assertEqual(len(labels), 6)
+        np.testing.assert_allclose(values - np.arange(6)[:,None], np.tile(keys[:,0], (6,1)), rtol=1e-5) #float32 storage
+
+    def test_permuted_keys_rejected(self):
+        permuted = self.keys[np.random.RandomState(1).permutation(len(self.keys))]
+        self.assertRaises(ValueError, resultcube.ResultCube, self.path, permuted, ['TMRT'], 4, mode='append')
+
+    def test_recombined_keys_rejected(self):
+        recombined = self.keys.copy(); recombined[:,1] = recombined[::-1,1] #same values in each column, other x,y pairs
+        self.assertRaises(ValueError, resultcube.ResultCube, self.path, recombined, ['TMRT'], 4, mode='append')
+
+if __name__ == '__main__':
+    unittest.main()
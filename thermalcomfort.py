@@ -14,7 +14,6 @@ The final section consists of the SET calculation, which relies on inputs as def
 #
 from scipy.optimize import fsolve
 import matplotlib.pyplot as plt
-import matplotlib.mlab as ml
 from matplotlib.path import Path
 import matplotlib.patches as patches
 
@@ -27,6 +26,10 @@ import pvlib
 import datetime
 import time
 
+import regrid
+import resultcube
+import kernels
+
 def install_and_import(package):
     import importlib
     try:
@@ -153,15 +156,22 @@ class pdcoord(object):
             try: return self.data[(self.data.x <=maxx) & (self.data.x >= minx) & (self.data.y <=maxy) & (self.data.y >= miny) &(self.data.z <=maxz) & (self.data.z >= minz)]
             except ValueError: print "No data found at that coordinate" 
 
-    def scatter3d(self,title='',size=40,model=[]):
-        """Returns a scatterplot of the pdcoord. Useful for visualizing 3D surface data """
+    def regrid(self,pedkeys_np,method='linear',dims=2,**kwargs):
+        """ Returns a new pdcoord with the values of this pdcoord interpolated onto the coordinates pedkeys_np (see regrid.Regridder for methods and options).
+        To map many fields that share the same coordinates (e.g. hourly data), build a regrid.Regridder once and apply it to each field instead. """
+        weights = regrid.Regridder(self.data, pedkeys_np, method=method, dims=dims, **kwargs)
+        return pdcoords_from_pedkeys(np.asarray(pedkeys_np,dtype=float), weights(self.data.v.values))
+
+    def scatter3d(self,title='',size=40,model=[],maxpoints=None):
+        """Returns a scatterplot of the pdcoord. Useful for visualizing 3D surface data. maxpoints limits the number of points drawn (every n-th point) for large data """
         font = {'weight' : 'medium',
                 'size'   : 22}
         #plt.rc('font', **font)
         fig = plt.figure()
         ax = fig.add_subplot(111, projection='3d'); ax.pbaspect = [1, 1, 1] #always need pbaspect
         ax.set_title(title)
-        p = ax.scatter(list(self.data.x), list(self.data.y),list(self.data.z),c = list(self.data.v),edgecolors='none', s=size, marker = ",", cmap ='jet')
+        data = self.data if maxpoints is None or len(self.data) <= maxpoints else self.data.iloc[::int(np.ceil(len(self.data)/float(maxpoints)))]
+        p = ax.scatter(data.x.values, data.y.values, data.z.values, c = data.v.values, edgecolors='none', s=size, marker = ",", cmap ='jet')
         ax.view_init(elev=90, azim=-89)
         ax.set_xlabel('X axis'); ax.set_ylabel('Y axis'); ax.set_zlabel('Z axis')
         fig.colorbar(p)
@@ -177,8 +187,9 @@ class pdcoord(object):
         
         return fig
         
-    def contour(self,title='',cbartitle = '',model=[], zmax = None, zmin = None, filename = None, resolution = 1, unit_str = '', bar = True):
-        """ Returns a figure with contourplot of 2D spatial data. Insert filename to save the figure as an image. Increase resolution to increase detail of interpolated data (<1 to decrease)"""
+    def contour(self,title='',cbartitle = '',model=[], zmax = None, zmin = None, filename = None, resolution = 1, unit_str = '', bar = True, show = True):
+        """ Returns a figure with contourplot of 2D spatial data. Insert filename to save the figure as an image. Increase resolution to increase detail of interpolated data (<1 to decrease)
+        Set show=False to save without opening a window. For many maps of the same keys (e.g. hourly), render.FrameRenderer is much faster """
 
         font = {'weight' : 'medium',
                 'size'   : 22}
@@ -187,7 +198,10 @@ class pdcoord(object):
         yi = np.linspace(min(self.data.y), max(self.data.y),len(set(self.data.y))*resolution)
         
     
-        zi = ml.griddata(self.data.x, self.data.y, self.data.v.interpolate(), xi, yi,interp='linear')
+        X,Y = np.meshgrid(xi,yi)
+        gridkeys = np.vstack([X.ravel(),Y.ravel()]).T
+        zi = regrid.Regridder(self.data, gridkeys, method='linear')(self.data.v.interpolate().values)
+        zi = np.ma.masked_invalid(zi.reshape(X.shape)) # points outside of the data are masked, as in matplotlib.mlab.griddata
         
         fig = plt.figure()
         plt.rc('font', **font)
@@ -203,7 +217,7 @@ class pdcoord(object):
             plt.gca().add_patch(shape)
         except TypeError:
             pass
-        plt.show()
+        if show: plt.show()
         
         try:
             fig.savefig(filename)
@@ -222,6 +236,11 @@ def pdcoords_from_pedkeys(pedkeys_np, values = np.zeros(0)):
     empty = pdcoord(zip(pedkeys_np.transpose()[0], pedkeys_np.transpose()[1], pedkeys_np.transpose()[2],fill))
     return empty
 
+def pdcoord_from_cube(cube, variable, time, region=None):
+    """ Creates a pdcoord of one variable at one time from a resultcube.ResultCube (or the path of its folder), reading only the chunks within region = (xmin,ymin,xmax,ymax) """
+    if not hasattr(cube,'slice'): cube = resultcube.ResultCube(cube)
+    return pdcoord(cube.slice(variable, time, region))
+
 #%% Part 2) Radiation Model Functions
 
 #1) Calculate solar parameters
@@ -326,7 +345,9 @@ def fourpiradiation(key, model,Ndir=200):
     return SVF, GVF, np.array(intercepts)
 #%% Step 4
 def call_values(intercepts, surfpdcoord, gridsize):
-    """ Given a list of intercepts, a pdcoord of surface values, and the grid size, a list of values is returned """
+    """ Given a list of intercepts, a pdcoord of surface values, and the grid size, a list of values is returned.
+    Surface data that can be indexed directly (e.g. facegrid.FaceGrid) is looked up without the box search of gridsize. """
+    if hasattr(surfpdcoord, 'lookup'): return surfpdcoord.lookup(intercepts)
     visibletemps = [surfpdcoord.val_at_coord(target,gridsize).v.mean() for target in intercepts]
     return np.array(visibletemps)
  #%% Step 5
@@ -366,15 +387,18 @@ def meanradtemp(Esky,Esurf, Eground,Ereflect, solarparam, SVF, GVF,  pedestrian_
     
     return results
 
-def all_mrt(key,compound,pdAirTemp,pdReflect,pdSurfTemp,solarparam,model_inputs,ped_properties,gridsize=1):
-    """ Accepts dataframe of solar parameters, model inputs. This function calls all the previous functions in order to calculate each component needed in the Stefan-Boltzmann equation for mean radiant temperature."""
+def all_mrt(key,compound,pdAirTemp,pdReflect,pdSurfTemp,solarparam,model_inputs,ped_properties,gridsize=1,viewfactors=None,shadowint=None):
+    """ Accepts dataframe of solar parameters, model inputs. This function calls all the previous functions in order to calculate each component needed in the Stefan-Boltzmann equation for mean radiant temperature.
+    If the (SVF, GVF, intercepts) at key are already known (e.g. from a viewcache.ViewFactorCache), pass them as viewfactors to skip fourpiradiation().
+    Likewise, shadowint (0 shaded, 1 sunlit) skips check_shadow(), e.g. for models given as boxes (see raycast.py)."""
     sigma =5.67*10**(-8)
     RH = model_inputs.RH[0]
     try: Esky =np.mean(calc_Esky_emis(pdAirTemp.val_at_coord(key).v, RH)) #Calculation of sky irradiance if air temperature is a pdcoord
     except AttributeError: Esky = calc_Esky_emis(pdAirTemp, RH) #calculation of Esky if air temperature is a bulk value
-    svf, gvf, intercepts = fourpiradiation(key, compound) #Calculate Sky view factor, ground view factor, and locations ('intercepts') on the wall at which WVF and wall temperatures need to be retrieved. 
+    if viewfactors is None: svf, gvf, intercepts = fourpiradiation(key, compound) #Calculate Sky view factor, ground view factor, and locations ('intercepts') on the wall at which WVF and wall temperatures need to be retrieved. 
+    else: svf, gvf, intercepts = viewfactors
 
-    shadowint = check_shadow(key, compound,solarparam.solarvector[0]) #Check if the pedestrian is in a shaded area
+    if shadowint is None: shadowint = check_shadow(key, compound,solarparam.solarvector[0]) #Check if the pedestrian is in a shaded area
 
     try: SurfTemp =call_values(intercepts, pdSurfTemp, gridsize) # Retrieve surface temperatures at the wall intercepts if surface temperature is a pdcoord
     except AttributeError: SurfTemp = [pdSurfTemp]*len(intercepts) # If not, and surface temperature is constant, get a list of the bulk surface temperature according to the number of intercepts (this is like a wall view factor)
@@ -411,90 +435,95 @@ def all_mrt(key,compound,pdAirTemp,pdReflect,pdSurfTemp,solarparam,model_inputs,
 
 #%% SET Calculations 
 
-def calc_SET(microclimate,ped_properties):
-    """
-    Parameters
-    ---------
-    ped_properties:  DataFrame with columns 
-    ped_constants: Properties of a typical standing person. Dataframe with columns       'eff_radiation_surface_area_ratio'
-    microclimate: DataFrame with columns        'air_temperature','wind_speed','mean_radiant_temperature','RH'
-    
-    See Gagge 1986 and the thesis that accompanies this GitHub (Sin 2017) for details on each variable. 
-    """
+def SET_terms(T_air, wind_speed, mean_radiant_temperature, RH, ped_properties):
+    """ Terms of the SET energy balance of calc_SET() for arrays of air temperature, wind speed, Tmrt and RH (one value per point, or scalars) and one set of ped_properties.
+    Returns a dictionary of arrays: T_skin, T_clothing, Lewis_ratio, vapor_pressure, Tso (standard operative temperature), and the coefficients of the
+    equation solved for SET (see kernels.solve_set): Tso - SET + a*(ppso - c*exp(20.386-5132/(SET+273.15))) = 0 """
     k=0.155; #unit conversion factor for 1clo to m^2*K/W
     pt=101.325;   #local atmosphere presssure in kPa
     sigma =5.67*10**(-8)
+    p = dict((column, float(np.asarray(ped_properties[column]).ravel()[0])) for column in ped_properties.columns)
+    Ta, wind_speed, Tmrt, RH = [np.asarray(x,dtype=float) for x in np.broadcast_arrays(T_air, np.abs(wind_speed), mean_radiant_temperature, RH)]
     
-    wind_speed = abs(microclimate['wind_speed'][0])    
-    dubois_area = 0.202*ped_properties['mass']**0.425*ped_properties['height']**0.725
-    
-    H = ped_properties['met']*58.2 - ped_properties['work']   #1 met = 58.2
- 
-    body_mu = ped_properties['work']/ped_properties['met']/58.2 #1 met = 58.2
-    heat_produced = ped_properties['met']*(1-body_mu)*58.2 #1 met = 58.2
-    Tsk = ped_properties['T_skin'] = 35.7 - 0.032*heat_produced/dubois_area #Auliciems and Szokolay pg 19
-    
-    Ta = microclimate['T_air'][0]
-#    interm=(np.log(2)+((17.27*(Ta)/(237.2+(Ta)))))/17.27
-#    dpt=(237.3*interm)/(1-interm) #dew point and dry bulb are different
-    
-    Tdp = (243.04*(np.log(microclimate['RH']/100.) + (17.625 *Ta)/(243.04 +Ta)))/(17.625-np.log(microclimate['RH']/100.)-17.625 *Ta/(243.04+Ta))
-        
-    vp = microclimate['vapor_pressure'] = microclimate['RH']/100*0.133322*np.exp(20.386-5132/(Ta+273.15)) # water vapor pressure at air temp; units in kPa antoine equation
-    pssk=  np.exp(20.386-5132/(ped_properties['T_skin']+273.15))*.133322368 #water vapor pressure at skin; units in kPa
-    pdpt= np.exp(20.386-5132/(Tdp+273.15))*.133322368
-
-    #Hsk =  ped_properties['met']*58.2 - ped_properties['work'] - 0.0173*ped_properties['met']*58.2*(5.87-vp)- 0.0014*ped_properties['met']*58.2*(34-Ta)
+    dubois_area = 0.202*p['mass']**0.425*p['height']**0.725
+    H = p['met']*58.2 - p['work']   #1 met = 58.2
+    body_mu = p['work']/p['met']/58.2 #1 met = 58.2
+    heat_produced = p['met']*(1-body_mu)*58.2 #1 met = 58.2
+    Tsk = 35.7 - 0.032*heat_produced/dubois_area #Auliciems and Szokolay pg 19
     
+    vp = RH/100*0.133322*np.exp(20.386-5132/(Ta+273.15)) # water vapor pressure at air temp; units in kPa antoine equation
+    pssk=  np.exp(20.386-5132/(Tsk+273.15))*.133322368 #water vapor pressure at skin; units in kPa
     
-    Icl = k*ped_properties['iclo']
-    ped_properties['T_clothing']  = ped_properties['T_skin'] \
+    Icl = k*p['iclo']
+    Tcl = Tsk \
         - 0.0275*(H)\
         - Icl*((H)-3.05*(5.73-0.007*(H)-vp) \
         - 0.42*((H)-58.15) \
-        - 0.0173*ped_properties['met']*58.2*(5.87-vp) \
-        - 0.0014*ped_properties['met']*58.2*(34-Ta)) #other equation in Ye et al 2003, Doherty 1998
-       
+        - 0.0173*p['met']*58.2*(5.87-vp) \
+        - 0.0014*p['met']*58.2*(34-Ta)) #other equation in Ye et al 2003, Doherty 1998
     
     # heat transfer coefficients and operative temperature, pressure
-    if 5.66 *(ped_properties['met'][0] - 0.85)**0.39 >= 8.9*wind_speed**0.5:
-        hsc = 5.66 *(ped_properties['met'] - 0.85)**0.39
-    else:
-        hsc = 8.6*wind_speed**0.53 # Gagge 1986, ASHRAE convective heat transfer coeff
-    
+    hsc = np.where(5.66 *(p['met'] - 0.85)**0.39 >= 8.9*wind_speed**0.5, 5.66 *(p['met'] - 0.85)**0.39,
+                   8.6*wind_speed**0.53) # Gagge 1986, ASHRAE convective heat transfer coeff
     hsc = hsc*((vp+pt)/ 101.33)**0.55
     
-    lr = ped_properties['Lewis_ratio'] =  15.15 *(ped_properties['T_clothing'] + 273.2)/273.2 #[K/kPa] De Dear 1996
+    lr = 15.15 *(Tcl + 273.2)/273.2 #[K/kPa] De Dear 1996
     he=lr*hsc;  #evaporate heat transfer coefficient
     hesp=he*(101.33/(vp+pt))**0.45; ##standard evaporate heat transfer coefficient, from Gagge,1986 and ASHRAE   
     
-    hr=4*ped_properties['body_emis']*sigma*ped_properties['eff_radiation_SA_ratio']*(273.15+(ped_properties['T_clothing']+microclimate['mean_radiant_temperature'])/2.)**3;   #radiative heat transfer coefficient, ASHRAE handbook
+    hr=4*p['body_emis']*sigma*p['eff_radiation_SA_ratio']*(273.15+(Tcl+Tmrt)/2.)**3;   #radiative heat transfer coefficient, ASHRAE handbook
     hz=hr+hsc;
     
     # CLOTHING PARAMETERS
-    Ia=1./(hz*ped_properties['fcl']);   #intrinsic insulation of the air layer, Gagge 1986
+    Ia=1./(hz*p['fcl']);   #intrinsic insulation of the air layer, Gagge 1986
     hp=1./(Ia+Icl);   #Sensible Heat Transfer Coefficient, Gagge 1986
     hsp=hp+hr; #overall sensible heat transfer caefficient
 
-    Rea=1/(lr*ped_properties['fcl']*hsc); # Gagge 1986
-    Recl=Icl/(lr*ped_properties['icl'])  
+    Rea=1/(lr*p['fcl']*hsc); # Gagge 1986
+    Recl=Icl/(lr*p['icl'])  
     hep=1/(Rea+Recl);    #insensible heat transfer coefficient,Gagge 1986
         
     #Operative temperature and pressure
     v0 =0.08 #reference wind speed
-    #to= Ta+ (1. - 0.73*wind_speed**0.2)*(microclimate['mean_radiant_temperature'][0]- Ta)   # ISO 7726 , qtd in Kazkaz 2012
-    
-   # print microclimate['mean_radiant_temperature']
-    if wind_speed < 0.08:
-        to =  (hr*(microclimate['mean_radiant_temperature'])+hsc*Ta)/(hr+hsc) # ASHRAE, no wind correction
-    else: to=(hr*(microclimate['mean_radiant_temperature'])+hsc*(Ta*(wind_speed/v0)**0.5 - ped_properties['T_skin']*(wind_speed/v0-1)**0.5))/(hr+hsc) #operative temperature, Auliciems and Szokolay
-    ttso=microclimate['Tso']=(hp/hsp)*to+(1-hp/hsp)*(ped_properties['T_skin'])  #standard operative temperature[C]
+    with np.errstate(invalid='ignore'): #(wind_speed/v0-1)**0.5 is only used above v0
+        to = np.where(wind_speed < v0, (hr*Tmrt+hsc*Ta)/(hr+hsc), # ASHRAE, no wind correction
+                      (hr*Tmrt+hsc*(Ta*(wind_speed/v0)**0.5 - Tsk*(wind_speed/v0-1)**0.5))/(hr+hsc)) #operative temperature, Auliciems and Szokolay
+    ttso=(hp/hsp)*to+(1-hp/hsp)*Tsk  #standard operative temperature[C]
     ppso=(hep/hesp)*vp+(1.-hsp/hesp)*pssk; #standard operative pressure
+    return {'T_skin':Tsk, 'T_clothing':Tcl, 'Lewis_ratio':lr, 'vapor_pressure':vp, 'Tso':ttso,
+            'a':0.088*(hesp+hsc)/hsp, 'ppso':ppso, 'c':RH/100*.133322368}
+
+def calc_SET(microclimate,ped_properties,solver='fsolve'):
+    """
+    Parameters
+    ---------
+    ped_properties:  DataFrame with columns 
+    ped_constants: Properties of a typical standing person. Dataframe with columns       'eff_radiation_surface_area_ratio'
+    microclimate: DataFrame with columns        'air_temperature','wind_speed','mean_radiant_temperature','RH'
+    
+    solver:  'fsolve' (scipy) or 'newton' (kernels.solve_set, with the numba or numpy backend of kernels.py) for the root of the energy balance
+    
+    See Gagge 1986 and the thesis that accompanies this GitHub (Sin 2017) for details on each variable. The terms of the energy balance are calculated
+    in SET_terms(). For many points, calc_SET_array() is faster.
+    """
+    terms = SET_terms(microclimate['T_air'][0], microclimate['wind_speed'][0], microclimate['mean_radiant_temperature'][0], microclimate['RH'][0], ped_properties)
+    for column in ['T_skin','T_clothing','Lewis_ratio']: ped_properties[column] = float(terms[column])
+    microclimate['vapor_pressure'], microclimate['Tso'] = float(terms['vapor_pressure']), float(terms['Tso'])
     
     # skin wetness
     #w = ped_properties['skin_wetness'] = (Hsk - hp*(Tsk - to))/(hep*(pssk - vp))
-    func = lambda st : (ttso - st + (0.088*(hesp+hsc)/hsp)*(ppso-microclimate['RH']/100*.133322368*np.exp(20.386-5132/(st+273.15))))
+    if solver == 'newton':
+        s_set = microclimate['SET'] = kernels.solve_set(terms['Tso'], terms['a'], terms['ppso'], terms['c'])[0]
+        return s_set
+    func = lambda st : (terms['Tso'] - st + terms['a']*(terms['ppso']-terms['c']*np.exp(20.386-5132/(st+273.15))))
     try:
         s_set = microclimate['SET']= fsolve(func,0)[0]
     except NameError: s_set = np.nan
     return s_set
+
+def calc_SET_array(T_air, wind_speed, mean_radiant_temperature, RH, ped_properties):
+    """ Same as calc_SET(), for arrays of air temperature, wind speed, Tmrt and RH (one value per point, or scalars) and one set of ped_properties.
+    The terms of the energy balance are calculated on the whole arrays (SET_terms()), and the SET of all points is solved at once with kernels.solve_set().
+    Returns an array of SET (ped_properties is not modified) """
+    terms = SET_terms(T_air, wind_speed, mean_radiant_temperature, RH, ped_properties)
+    return kernels.solve_set(terms['Tso'], terms['a'], terms['ppso'], terms['c']).reshape(terms['Tso'].shape)
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Time series driver for hourly Tmrt and SET calculations.
+
+Each step of a time series first loads and prepares its inputs (surface temperature and reflection fields and air temperature from TUF-IOBES, recentering and repeat_outset,
+solar parameters), and then calculates Tmrt and SET at the pedestrian keys. run_timeseries() runs these two stages for a list of steps. With prefetch=True,
+the inputs of the next steps are loaded on a background thread (through a bounded queue) while the current step is calculated, so that reading files and
+calculating do not wait for each other.
+
+Example (see Examples/Step4_TimeSeries.py):
+    load = timeseries.tufiobes_loader(casefolder, origin=(a[0],a[1]))
+    results = timeseries.run_timeseries(range(1,24), load, compute, prefetch=True)
+"""
+import os
+import sys
+import threading
+import time
+import Queue
+
+import pandas as pd
+
+import thermalcomfort
+
+_done = object() #marks the end of the steps in the prefetch queue
+
+def read_tufiobes_step(casefolder, step):
+    """ Reads the surface data of one output step of a TUF-IOBES case folder (Sorted/<case>SurfaceProperties_<step>).
+    Returns a dictionary of pdcoords of surface temperature ('Tsurf') and reflected radiation ('Refl') """
+    case = os.path.basename(os.path.normpath(casefolder))
+    therm_input = pd.read_csv(os.path.join(casefolder,'Sorted',case+'SurfaceProperties_'+str(step)),delimiter=",",usecols=(2,3,4,6,7))
+    return {'Tsurf':thermalcomfort.pdcoord(therm_input[['x','y','z','temp']]),
+            'Refl':thermalcomfort.pdcoord(therm_input[['x','y','z','refl']])}
+
+def read_tufiobes_airtemp(casefolder):
+    """ Reads the air temperature (column 16) of Tsfc_Facets.out in a TUF-IOBES case folder. Returns a Series of the mean air temperature at each hour
+    of the day (1 to 24) over the simulated days, as in Examples/Step1_Model_SetUp.py """
+    facets = pd.read_csv(os.path.join(casefolder,'Tsfc_Facets.out'),usecols=[5,6,15],header=None,sep='\s+',names=['day','hour','temperature'])
+    return facets.groupby(facets['hour'].round().astype(int))['temperature'].mean()
+
+def tufiobes_loader(casefolder, origin=(0,0), repeat=2):
+    """ Returns a function that loads the surface data of a step with read_tufiobes_step(), recenters it at origin and repeats it 'repeat' times in all 8 directions (as in Examples/Step1_Model_SetUp.py).
+    The air temperature of the step (hour) from read_tufiobes_airtemp() is added as 'Tair' """
+    airtemp = read_tufiobes_airtemp(casefolder)
+    def load(step):
+        surfaces = read_tufiobes_step(casefolder, step)
+        for name in surfaces:
+            surfaces[name].recenter(origin=origin)
+            for n in range(repeat): surfaces[name].repeat_outset()
+        surfaces['Tair'] = airtemp[int(round(step))]
+        return surfaces
+    return load
+
+def prefetched(steps, load, queue_size=2):
+    """ Generator of (step, load(step)) for each step. The next steps (at most queue_size ahead) are loaded on a background thread while the current one is used.
+    Errors raised by load() are raised again in the calling thread. """
+    queue = Queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    def put(item):
+        while not stop.is_set(): #wait for space in the queue, unless the consumer has stopped
+            try: queue.put(item, timeout=0.1); return True
+            except Queue.Full: pass
+        return False
+    def producer():
+        try:
+            for step in steps:
+                if not put((step, load(step), None)): return
+        except Exception:
+            put((None, None, sys.exc_info()))
+            return
+        put(_done)
+    thread = threading.Thread(target=producer)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            item = queue.get()
+            if item is _done: break
+            step, inputs, error = item
+            if error is not None: raise error[0], error[1], error[2]
+            yield step, inputs
+    finally:
+        stop.set()
+
+def run_timeseries(steps, load, compute, prefetch=True, queue_size=2):
+    """ Calculates compute(step, load(step)) for each step and returns the list of results.
+    load(step) reads and prepares the inputs of a step (e.g. tufiobes_loader()); compute(step, inputs) runs all_mrt/calc_SET on them.
+    With prefetch, loading runs on a background thread, up to queue_size steps ahead of the calculation. """
+    time1 = time.time()
+    source = prefetched(steps, load, queue_size) if prefetch else ((step, load(step)) for step in steps)
+    results = [compute(step, inputs) for step, inputs in source]
+    print 'TOTAL CALCULATION TIME: ', time.time()-time1, 'seconds'
+    return results
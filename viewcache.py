@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+View factor cache with incremental updates for changes of the building model.
+
+fourpiradiation() traces Ndir rays per pedestrian key against the whole model. When a design iteration only moves or adds one block, most of these rays are
+unchanged. ViewFactorCache keeps the intercept of every ray at every key. When the model is replaced, the buildings that differ between the old and the new
+compound are identified by their bounding boxes, and only the rays that pass through one of these bounding boxes before reaching their cached intercept are
+traced again. SVF, GVF, intercepts and Tmrt are then updated for the affected keys only.
+
+Example:
+    cache = viewcache.ViewFactorCache(compound)
+    TMRT = viewcache.mrt_with_cache(cache, pedkeys, pdTa, pdReflect, pdTs, solarparam, model_inputs, ped_properties)
+    ... change the model ...
+    affected = viewcache.incremental_mrt(cache, newcompound, TMRT, pdTa, pdReflect, pdTs, solarparam, model_inputs, ped_properties)
+"""
+from collections import Counter
+
+import numpy as np
+
+import ExtraFunctions
+import raycast
+import thermalcomfort
+
+
+def changed_bboxes(old_bboxes, new_bboxes, decimals=4):
+    """ Returns the bounding boxes of buildings that are only in one of the two arrays of bounding boxes, i.e. buildings that were removed, moved or added.
+    Buildings are identified by their bounding box (rounded to 'decimals'), so a building replaced by a different shape with the same bounding box is not detected. """
+    old = Counter(tuple(row) for row in np.round(old_bboxes,decimals))
+    new = Counter(tuple(row) for row in np.round(new_bboxes,decimals))
+    changed = (old - new) + (new - old)
+    return np.array(list(changed.elements()),dtype=float).reshape(-1,6)
+
+class ViewFactorCache(object):
+    """ Stores the intercept and distance of each of the Ndir rays traced from each pedestrian key, for the current model.
+    viewfactors(key) returns the same (SVF, GVF, intercepts) as fourpiradiation(key, model, Ndir), and can be passed to all_mrt(..., viewfactors=...) """
+
+    def __init__(self, model, Ndir=200):
+        self.model = model
+        self.Ndir = Ndir
+        self.upper, self.lower = raycast.unitball_dirs(Ndir)
+        self.directions = np.vstack([self.upper,self.lower])
+        self.solids, self.bboxes = ExtraFunctions.bboxes_frm_compound(model)
+        self.rays = {} #key: (intercepts, distances)
+        self.traced = 0 #total number of rays traced, to compare full and incremental updates
+
+    def trace(self, key):
+        """ Returns the intercepts and distances of all rays at key, tracing them if the key is not cached yet """
+        key = tuple(float(c) for c in key)
+        if key not in self.rays:
+            self.rays[key] = raycast.trace_rays(key, self.model, self.directions)
+            self.traced += len(self.directions)
+        return self.rays[key]
+
+    def viewfactors(self, key):
+        """ Returns SVF, GVF and the list of intercepts at key, in the format of fourpiradiation() """
+        hits, dist = self.trace(key)
+        hit = np.isfinite(dist)
+        Nup = len(self.upper)
+        SVF = (~hit[:Nup]).sum()/float(Nup)
+        GVF = (~hit[Nup:]).sum()/float(len(self.lower))
+        return SVF, GVF, hits[hit]
+
+    def update(self, newmodel, solarvector=None):
+        """ Replaces the model by newmodel and re-traces the cached rays that may be affected by the buildings that changed.
+        Returns the list of keys at which the view factors changed, or (if solarvector is given) at which the shadow may have changed. """
+        newsolids, newbboxes = ExtraFunctions.bboxes_frm_compound(newmodel)
+        changed = changed_bboxes(self.bboxes, newbboxes)
+        self.model, self.solids, self.bboxes = newmodel, newsolids, newbboxes
+        affected = []
+        if not len(changed): return affected
+        for key, (hits, dist) in self.rays.items():
+            entry = raycast.ray_box_entry(key, self.directions, changed).min(axis=1)
+            redo = np.nonzero(np.isfinite(entry) & (entry <= dist + 1e-6))[0] #the ray crosses a changed building before its cached intercept
+            if redo.size:
+                hits[redo], dist[redo] = raycast.trace_rays(key, newmodel, self.directions[redo])
+                self.traced += redo.size
+            sun = solarvector is not None and np.isfinite(raycast.ray_box_entry(key, [solarvector], changed)).any()
+            if redo.size or sun: affected.append(key)
+        return affected
+
+def mrt_with_cache(cache, pedkeys, pdAirTemp, pdReflect, pdSurfTemp, solarparam, model_inputs, ped_properties, gridsize=1, results=None):
+    """ Calculates Tmrt with all_mrt() at each of pedkeys, using (and filling) the view factors stored in cache.
+    Returns a pdcoord of Tmrt. If a results pdcoord is given, only its rows at pedkeys are recalculated. """
+    if results is None: results = thermalcomfort.pdcoords_from_pedkeys(np.asarray(pedkeys,dtype=float))
+    rows = dict((tuple(xyz), index) for index, xyz in zip(results.data.index, results.data[['x','y','z']].values.tolist()))
+    for key in pedkeys:
+        key = tuple(float(c) for c in key)
+        mrt = thermalcomfort.all_mrt(key,cache.model,pdAirTemp,pdReflect,pdSurfTemp,solarparam,model_inputs,ped_properties,gridsize=gridsize,viewfactors=cache.viewfactors(key))
+        results.data.loc[rows[key],'v'] = mrt.TMRT[0]
+    return results
+
+def incremental_mrt(cache, newmodel, results, pdAirTemp, pdReflect, pdSurfTemp, solarparam, model_inputs, ped_properties, gridsize=1):
+    """ Updates the cache to newmodel and recalculates the Tmrt pdcoord 'results' at the affected keys only. Returns the list of affected keys of results
+    (the cache may also hold keys of other grids, e.g. when shared with a ComfortService; their rays are re-traced but their Tmrt is not calculated here). """
+    traced = cache.traced
+    affected = cache.update(newmodel, solarparam.solarvector[0])
+    print 'Re-traced', cache.traced - traced, 'of', len(cache.rays)*len(cache.directions), 'rays;', len(affected), 'of', len(cache.rays), 'keys affected'
+    inresults = set(tuple(xyz) for xyz in results.data[['x','y','z']].values.tolist())
+    affected = [key for key in affected if tuple(float(c) for c in key) in inresults]
+    mrt_with_cache(cache, affected, pdAirTemp, pdReflect, pdSurfTemp, solarparam, model_inputs, ped_properties, gridsize=gridsize, results=results)
+    return affected